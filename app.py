@@ -20,6 +20,8 @@ from aws_cdk import (
 )
 
 FETCH_BATCH_SIZE = os.environ["FETCH_BATCH_SIZE"]
+FETCH_CONCURRENCY = os.environ.get("FETCH_CONCURRENCY", "16")
+PARSE_CONCURRENCY = os.environ.get("PARSE_CONCURRENCY", "8")
 URL_TABLE_TTL = os.environ["URL_TABLE_TTL"]
 YELP_TABLE_TTL = os.environ["YELP_TABLE_TTL"]
 ALARM_TOPIC_EMAIL = os.environ["ALARM_TOPIC_EMAIL"]
@@ -29,6 +31,9 @@ URL_TABLE_NAME = "UrlTable"
 YELP_TABLE_NAME = "YelpTable"
 CONFIG_TABLE_NAME = "ConfigTable"
 PAGE_BUCKET_NAME = "YelpOrchestratorPageBucket"
+# Target of the dependency layers, matching aws_lambda.Runtime.PYTHON_3_8 on x86_64
+LAMBDA_PLATFORM = "manylinux2014_x86_64"
+LAMBDA_PYTHON_VERSION = "3.8"
 
 
 class YelpOrchestratorStack(core.Stack):
@@ -81,6 +86,15 @@ class YelpOrchestratorStack(core.Stack):
             ),
             index_name="PageUrl",
         )
+        url_table.add_global_secondary_index(
+            partition_key=aws_dynamodb.Attribute(
+                name="FetchBucket", type=aws_dynamodb.AttributeType.STRING
+            ),
+            sort_key=aws_dynamodb.Attribute(
+                name="LastFetched", type=aws_dynamodb.AttributeType.NUMBER
+            ),
+            index_name="FetchBucket",
+        )
         self.url_table = url_table
 
     def create_yelp_table(self):
@@ -214,8 +228,12 @@ class YelpOrchestratorStack(core.Stack):
         # Install requirements for layer in the output_dir
         if path.exists(requirements_file):
             # Note: Pip will create the output dir if it does not exist
+            # Compiled wheels (e.g. lxml) must match the Lambda runtime, not the synthesizing host.
+            # --upgrade replaces whatever an earlier, unpinned build left in output_dir
             subprocess.check_call(
-                f"pip install -r {requirements_file} -t {output_dir}/python".split()
+                f"pip install -r {requirements_file} -t {output_dir}/python"
+                f" --platform {LAMBDA_PLATFORM} --python-version {LAMBDA_PYTHON_VERSION}"
+                " --only-binary=:all: --upgrade".split()
             )
             return [
                 aws_lambda.LayerVersion(
@@ -246,7 +264,7 @@ class YelpOrchestratorStack(core.Stack):
         # Add permissions
         self.config_table.grant_read_write_data(self.apig_handler)
         self.config_table.grant_read_data(self.url_requester)
-        self.config_table.grant_read_data(self.yelp_cleaner)
+        self.config_table.grant_read_write_data(self.yelp_cleaner)
         self.yelp_table.grant_read_write_data(self.apig_handler)
         self.yelp_table.grant_read_data(self.url_requester)
         self.yelp_table.grant_read_write_data(self.yelp_parser)
@@ -257,6 +275,7 @@ class YelpOrchestratorStack(core.Stack):
         self.url_table.grant_read_write_data(self.yelp_cleaner)
         self.page_bucket.grant_read_write(self.yelp_parser)
         self.page_bucket.grant_read_write(self.page_fetcher)
+        self.page_bucket.grant_read(self.yelp_cleaner)
 
     def add_env_vars(self):
         env_vars_to_add = {
@@ -265,6 +284,8 @@ class YelpOrchestratorStack(core.Stack):
             "CONFIG_TABLE_NAME": self.config_table.table_name,
             "PAGE_BUCKET_NAME": self.page_bucket.bucket_name,
             "FETCH_BATCH_SIZE": FETCH_BATCH_SIZE,
+            "FETCH_CONCURRENCY": FETCH_CONCURRENCY,
+            "PARSE_CONCURRENCY": PARSE_CONCURRENCY,
             "URL_TABLE_TTL": URL_TABLE_TTL,
             "YELP_TABLE_TTL": YELP_TABLE_TTL,
         }
@@ -281,15 +302,23 @@ class YelpOrchestratorStack(core.Stack):
             *self.get_generic_apig_graphs(self.apig),
             self.text_widget("ApiGatewayHandler", "#"),
             *self.get_generic_lambda_graphs(self.apig_handler),
+            *self.get_dynamodb_graphs("ApiGatewayHandler"),
             self.text_widget("YelpParser", "#"),
             *self.get_generic_lambda_graphs(self.yelp_parser),
+            *self.get_dynamodb_graphs("YelpParser"),
+            *self.get_yelp_parser_graphs(),
             self.text_widget("UrlRequester", "#"),
             *self.get_generic_lambda_graphs(self.url_requester),
+            *self.get_dynamodb_graphs("UrlRequester"),
+            self.graph_widget("UrlsUpserted", self.custom_metric("UrlRequester", "UrlsUpserted")),
             self.text_widget("PageFetcher", "#"),
             *self.get_generic_lambda_graphs(self.page_fetcher),
+            *self.get_dynamodb_graphs("PageFetcher"),
+            *self.get_page_fetcher_graphs(),
             self.text_widget("YelpCleaner", "#"),
             *self.get_generic_lambda_graphs(self.yelp_cleaner),
-            self.get_yelp_cleaner_graph(),
+            *self.get_dynamodb_graphs("YelpCleaner"),
+            *self.get_yelp_cleaner_graphs(),
         )
         self.dashboard = dashboard
 
@@ -350,20 +379,99 @@ class YelpOrchestratorStack(core.Stack):
         )
 
     @staticmethod
-    def get_yelp_cleaner_graph():
+    def custom_metric(function_name, metric_name, statistic="Sum"):
+        """A metric that yelp.metrics emitted from the given function."""
+        return aws_cloudwatch.Metric(
+            namespace=STACK_NAME,
+            metric_name=metric_name,
+            dimensions={"Function": function_name},
+            statistic=statistic,
+            period=core.Duration.minutes(5),
+        )
+
+    @staticmethod
+    def latency_graph(title, function_name, metric_name):
         return YelpOrchestratorStack.graph_widget(
-            "YelpCleanerDeletions",
+            title,
             *[
-                aws_cloudwatch.Metric(
-                    namespace="YelpOrchestrator",
-                    metric_name=metric_name,
-                    statistic="Sum",
-                    period=core.Duration.minutes(5),
-                )
-                for metric_name in ("UrlTableRecordsDeleted", "YelpTableRecordsDeleted")
+                YelpOrchestratorStack.custom_metric(function_name, metric_name, statistic)
+                for statistic in ("p50", "p90", "p99")
             ],
         )
 
+    @staticmethod
+    def get_dynamodb_graphs(function_name):
+        return (
+            YelpOrchestratorStack.graph_widget(
+                "DynamoDBCalls", YelpOrchestratorStack.custom_metric(function_name, "DynamoDBCalls")
+            ),
+            YelpOrchestratorStack.latency_graph(
+                "DynamoDBLatency", function_name, "DynamoDBLatency"
+            ),
+        )
+
+    @staticmethod
+    def get_page_fetcher_graphs():
+        return (
+            YelpOrchestratorStack.latency_graph("FetchLatency", "PageFetcher", "FetchLatency"),
+            YelpOrchestratorStack.graph_widget(
+                "Bytes",
+                *[
+                    YelpOrchestratorStack.custom_metric("PageFetcher", metric_name)
+                    for metric_name in ("FetchDecodedBytes", "S3BytesUploaded")
+                ],
+            ),
+            YelpOrchestratorStack.graph_widget(
+                "Pages",
+                *[
+                    YelpOrchestratorStack.custom_metric("PageFetcher", metric_name)
+                    for metric_name in (
+                        "PagesUploaded",
+                        "PagesUnchanged",
+                        "PagesNotModified",
+                        "FetchErrors",
+                    )
+                ],
+            ),
+        )
+
+    @staticmethod
+    def get_yelp_parser_graphs():
+        return (
+            YelpOrchestratorStack.graph_widget(
+                "ParseTime (p90)",
+                *[
+                    YelpOrchestratorStack.custom_metric("YelpParser", f"{parser}Time", "p90")
+                    for parser in ("UserMetadataParser", "ReviewsPageParser", "ReviewStatusParser")
+                ],
+            ),
+            YelpOrchestratorStack.latency_graph("S3ReadLatency", "YelpParser", "S3ReadLatency"),
+            YelpOrchestratorStack.graph_widget(
+                "S3BytesDownloaded",
+                YelpOrchestratorStack.custom_metric("YelpParser", "S3BytesDownloaded"),
+            ),
+            YelpOrchestratorStack.graph_widget(
+                "ParseErrors", YelpOrchestratorStack.custom_metric("YelpParser", "ParseErrors")
+            ),
+        )
+
+    @staticmethod
+    def get_yelp_cleaner_graphs():
+        return (
+            YelpOrchestratorStack.graph_widget(
+                "YelpCleanerDeletions",
+                *[
+                    YelpOrchestratorStack.custom_metric("YelpCleaner", metric_name)
+                    for metric_name in ("UrlTableRecordsDeleted", "YelpTableRecordsDeleted")
+                ],
+            ),
+            YelpOrchestratorStack.graph_widget(
+                "CleanerUsersSkipped",
+                YelpOrchestratorStack.custom_metric("YelpCleaner", "CleanerUsersSkipped"),
+            ),
+            YelpOrchestratorStack.latency_graph("FetchLatency", "YelpCleaner", "FetchLatency"),
+        )
+
     @staticmethod
     def text_widget(text, size="###"):
         return aws_cloudwatch.TextWidget(markdown=f"{size} {text}", height=1, width=24)
@@ -1,6 +1,7 @@
 import json
 from http import HTTPStatus
 
+from yelp import metrics
 from yelp.persistence import config_table, url_table, yelp_table
 from yelp.persistence.config_table import upsert_user_id
 
@@ -55,6 +56,7 @@ def handle_user(user_id, method):
     return {"statusCode": HTTPStatus.NOT_IMPLEMENTED}
 
 
+@metrics.emits_metrics("ApiGatewayHandler")
 def handle(event, context=None):
     print(f"Triggered for event: {event}")
     resource, method = event["resource"], event["httpMethod"]
@@ -6,5 +6,36 @@ YELP_TABLE_NAME = os.environ["YELP_TABLE_NAME"]
 CONFIG_TABLE_NAME = os.environ["CONFIG_TABLE_NAME"]
 
 FETCH_BATCH_SIZE = int(os.environ["FETCH_BATCH_SIZE"])
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", 16))
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("FETCH_CONNECT_TIMEOUT", 3.05))
+FETCH_READ_TIMEOUT = float(os.environ.get("FETCH_READ_TIMEOUT", 30))
+# page_fetcher writes fetch results to UrlTable every this many completed fetches
+FETCH_FLUSH_SIZE = int(os.environ.get("FETCH_FLUSH_SIZE", 25))
+# Set to "false" to gather batches with a full UrlTable scan instead of the FetchBucket GSI
+FETCH_USE_INDEX = os.environ.get("FETCH_USE_INDEX", "true").lower() == "true"
+# Segments that full-table scans read concurrently
+SCAN_TOTAL_SEGMENTS = int(os.environ.get("SCAN_TOTAL_SEGMENTS", 4))
 URL_TABLE_TTL = int(os.environ["URL_TABLE_TTL"])
+URL_UPSERT_CONCURRENCY = int(os.environ.get("URL_UPSERT_CONCURRENCY", 8))
+# The cron only re-upserts tracked URLs whose TTL runs out within this many seconds, unless
+# CRON_FULL_REFRESH is "true", which re-upserts every URL on every run
+URL_TTL_REFRESH_WINDOW = int(os.environ.get("URL_TTL_REFRESH_WINDOW", URL_TABLE_TTL // 2))
+CRON_FULL_REFRESH = os.environ.get("CRON_FULL_REFRESH", "false").lower() == "true"
 YELP_TABLE_TTL = int(os.environ["YELP_TABLE_TTL"])
+# Unchanged pages are still re-uploaded (and so re-parsed) after this many seconds, which keeps the
+# YelpTable records derived from them from expiring
+PAGE_REUPLOAD_AGE = int(os.environ.get("PAGE_REUPLOAD_AGE", YELP_TABLE_TTL // 2))
+
+PARSE_CONCURRENCY = int(os.environ.get("PARSE_CONCURRENCY", 8))
+
+CLEANER_USER_CONCURRENCY = int(os.environ.get("CLEANER_USER_CONCURRENCY", 4))
+# Cap on requests to Yelp in flight at once across every user the cleaner processes
+CLEANER_MAX_IN_FLIGHT = int(os.environ.get("CLEANER_MAX_IN_FLIGHT", FETCH_CONCURRENCY))
+# The cleaner reads a page from PageBucket instead of Yelp when page_fetcher got it this recently
+CLEANER_PAGE_MAX_AGE = int(os.environ.get("CLEANER_PAGE_MAX_AGE", 60 * 60))
+CLEANER_DELETE_CONCURRENCY = int(os.environ.get("CLEANER_DELETE_CONCURRENCY", 4))
+# Set to "true" to only report what the cleaner would delete
+CLEANER_DRY_RUN = os.environ.get("CLEANER_DRY_RUN", "false").lower() == "true"
+
+# "lxml" (C-accelerated, used when installed) or "html.parser" (pure Python fallback)
+HTML_PARSER_BACKEND = os.environ.get("HTML_PARSER_BACKEND", "lxml")
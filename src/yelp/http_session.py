@@ -0,0 +1,30 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (3.05, 30)
+DEFAULT_POOL_SIZE = 10
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """Applies a default timeout to every request that doesn't specify one."""
+
+    def __init__(self, *args, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT) -> requests.Session:
+    """Keep-alive session that can serve `pool_size` concurrent requests per host."""
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, timeout=timeout
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
@@ -0,0 +1,118 @@
+import functools
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import Lock
+
+NAMESPACE = "YelpOrchestrator"
+FUNCTION_DIMENSION = "Function"
+# EMF accepts at most this many values per metric in one document
+MAX_VALUES = 100
+
+COUNT = "Count"
+BYTES = "Bytes"
+MILLISECONDS = "Milliseconds"
+
+# Buffered until `flush`, shared by every thread of the invocation
+_LOCK = Lock()
+_COUNTERS = defaultdict(int)
+_VALUES = defaultdict(list)
+_UNITS = {}
+
+
+def count(name, value=1, unit=COUNT):
+    with _LOCK:
+        _COUNTERS[name] += value
+        _UNITS[name] = unit
+
+
+def record(name, value, unit=COUNT):
+    """Adds one value to the metric's distribution, e.g. a latency or a size."""
+    with _LOCK:
+        _VALUES[name].append(value)
+        _UNITS[name] = unit
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+
+def _before_call(context, **kwargs):
+    context["metrics_start"] = time.perf_counter()
+
+
+def _after_call(service, context, **kwargs):
+    count(f"{service}Calls")
+    if start := context.get("metrics_start"):
+        record(f"{service}Latency", (time.perf_counter() - start) * 1000, MILLISECONDS)
+
+
+def instrument(client):
+    """Counts and times every API call the boto3 client makes, e.g. `DynamoDBCalls` and
+    `DynamoDBLatency`."""
+    service = client.meta.service_model.service_id.replace(" ", "")
+    # The client's own emitter, so these only ever see this client's calls. First, so responses
+    # short-circuited by other before-call handlers (e.g. botocore's Stubber) are timed too
+    client.meta.events.register_first("before-call.*.*", _before_call)
+    client.meta.events.register("after-call.*.*", functools.partial(_after_call, service))
+    return client
+
+
+def _documents(function_name, counters, values, units):
+    dimensions = {FUNCTION_DIMENSION: function_name}
+    chunks = max([1] + [-(-len(v) // MAX_VALUES) for v in values.values()])
+    for i in range(chunks):
+        metrics = dict(counters) if i == 0 else {}
+        for name, vals in values.items():
+            if chunk := vals[i * MAX_VALUES : (i + 1) * MAX_VALUES]:
+                metrics[name] = chunk
+        yield {
+            "_aws": {
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [{"Name": name, "Unit": units[name]} for name in metrics],
+                    }
+                ],
+                "Timestamp": int(time.time() * 1000),
+            },
+            **dimensions,
+            **metrics,
+        }
+
+
+def flush(function_name):
+    """Prints everything buffered as one EMF document (more only when a metric has over
+    MAX_VALUES values) and resets the buffer."""
+    with _LOCK:
+        counters, values, units = dict(_COUNTERS), dict(_VALUES), dict(_UNITS)
+        _COUNTERS.clear()
+        _VALUES.clear()
+        _UNITS.clear()
+    if not counters and not values:
+        return
+    for document in _documents(function_name, counters, values, units):
+        print(json.dumps(document))
+
+
+def emits_metrics(function_name):
+    """Decorates a Lambda handler to flush the metrics it buffered once it returns or raises."""
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                flush(function_name)
+
+        return wrapper
+
+    return decorator
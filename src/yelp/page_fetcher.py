@@ -1,13 +1,45 @@
+import hashlib
+import heapq
+import re
+import time
 import traceback
-from queue import Queue
-from threading import Thread
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from http import HTTPStatus
+from typing import Dict, List, Optional
+
+from yelp import metrics
+from yelp.config import (
+    FETCH_BATCH_SIZE,
+    FETCH_CONCURRENCY,
+    FETCH_CONNECT_TIMEOUT,
+    FETCH_FLUSH_SIZE,
+    FETCH_READ_TIMEOUT,
+    FETCH_USE_INDEX,
+    PAGE_REUPLOAD_AGE,
+)
+from yelp.http_session import create_session
+from yelp.persistence.page_bucket import upload_page
+from yelp.persistence.url_table import (
+    NEVER_FETCHED,
+    UrlTableSchema,
+    get_all_url_items,
+    get_due_url_items,
+    update_fetched_items,
+)
 
-import requests
+# Shared across warm invocations so threads and connections are only created once per container
+EXECUTOR = ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY)
+SESSION = create_session(
+    pool_size=FETCH_CONCURRENCY, timeout=(FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT)
+)
 
-from yelp.config import FETCH_BATCH_SIZE
-from yelp.persistence.page_bucket import upload_page
-from yelp.persistence.url_table import UrlTableSchema, get_all_url_items, update_fetched_url
+
+# Markup that changes on every response (CSP nonces, CSRF tokens, request ids) and would otherwise
+# make every fetch of an unchanged page look new
+VOLATILE_MARKUP_REGEX = re.compile(
+    rb'((?:nonce|csrf|csrf-token|request_id)="?|class="csrftok"\s+value=")[0-9a-f]+'
+)
 
 
 class FetchError(Exception):
@@ -16,70 +48,174 @@ class FetchError(Exception):
         super().__init__(args)
 
 
-def fetch(url):
-    resp = requests.get(url)
+@dataclass
+class FetchedPage:
+    status_code: int
+    content: Optional[bytes]
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+def fetch_page(url, etag=None, last_modified=None) -> FetchedPage:
+    """Conditional GET: a page that hasn't changed since `etag`/`last_modified` comes back as a
+    304 FetchedPage without content."""
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    with metrics.timer("FetchLatency"):
+        resp = SESSION.get(url, headers=headers)
+    # The body as decoded by requests, i.e. after Content-Encoding, not the bytes on the wire
+    metrics.count("FetchDecodedBytes", len(resp.content), metrics.BYTES)
     print(
         f"GET request finished. [status_code={resp.status_code}, content_length={len(resp.content)}]"
     )
-    if resp.status_code != 200:
+    if resp.status_code == HTTPStatus.NOT_MODIFIED:
+        return FetchedPage(
+            resp.status_code,
+            None,
+            resp.headers.get("ETag", etag),
+            resp.headers.get("Last-Modified", last_modified),
+        )
+    if resp.status_code != HTTPStatus.OK:
         raise FetchError(
             resp.status_code,
             f"Fetch error. [status_code={resp.status_code}, text={resp.text}]",
         )
-    return resp.content
+    return FetchedPage(
+        resp.status_code, resp.content, resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+    )
+
+
+def fetch(url):
+    return fetch_page(url).content
+
+
+def page_digest(content: bytes) -> str:
+    return hashlib.sha256(VOLATILE_MARKUP_REGEX.sub(rb"\1", content)).hexdigest()
+
+
+def is_upload_fresh(item, now):
+    """Whether an unchanged page can skip re-upload, given when it was last uploaded."""
+    return now - int(item.get(UrlTableSchema.LAST_UPLOADED, 0)) < PAGE_REUPLOAD_AGE
+
+
+def get_validators(item, now):
+    """Returns the (ETag, Last-Modified) to revalidate an item with, or (None, None) when its page
+    is due to be re-uploaded regardless."""
+    if not is_upload_fresh(item, now):
+        return None, None
+    return item.get(UrlTableSchema.ETAG), item.get(UrlTableSchema.LAST_MODIFIED)
+
+
+def with_validators(item, page: FetchedPage):
+    item = dict(item)
+    for attr, value in (
+        (UrlTableSchema.ETAG, page.etag),
+        (UrlTableSchema.LAST_MODIFIED, page.last_modified),
+    ):
+        if value:
+            item[attr] = value
+        else:
+            item.pop(attr, None)
+    return item
+
+
+class FetchResultNotWrittenError(Exception):
+    pass
+
+
+@dataclass
+class FetchResult:
+    item: Dict
+    status_code: int
+    error: Optional[Exception] = None
+
+    @property
+    def url(self):
+        return self.item[UrlTableSchema.URL]
 
 
-# TODO: Replace with ThreadPoolExecutor
 class BatchProcessor:
-    def __init__(self):
-        self.queue = Queue()
-        self.errors = []
+    def __init__(self, executor=EXECUTOR, flush_size=FETCH_FLUSH_SIZE):
+        self.executor = executor
+        self.flush_size = flush_size
+        self.started = int(time.time())
+        self.results: List[FetchResult] = []
+
+    @property
+    def errors(self) -> List[Exception]:
+        return [result.error for result in self.results if result.error]
 
-    def consumer(self):
-        item = self.queue.get()
+    def consumer(self, item: Dict) -> FetchResult:
         url = item[UrlTableSchema.URL]
         try:
-            try:
-                content = fetch(url)
-                upload_page(url, content)
-                status_code = 200
-            except FetchError as err:
-                self.errors.append(err)
-                traceback.print_exc()
-                status_code = err.status_code
-
-            update_fetched_url(url, status_code)
-
+            page = fetch_page(url, *get_validators(item, self.started))
+            if page.status_code == HTTPStatus.NOT_MODIFIED:
+                print(f"Page not modified, skipping upload. [{url=}]")
+                metrics.count("PagesNotModified")
+                return FetchResult(with_validators(item, page), page.status_code)
+
+            digest = page_digest(page.content)
+            if digest == item.get(UrlTableSchema.CONTENT_DIGEST) and is_upload_fresh(
+                item, self.started
+            ):
+                print(f"Page content unchanged, skipping upload. [{url=}]")
+                metrics.count("PagesUnchanged")
+                return FetchResult(with_validators(item, page), page.status_code)
+
+            upload_page(url, page.content, item.get(UrlTableSchema.USER_ID))
+            metrics.count("PagesUploaded")
+            item = with_validators(item, page)
+            item[UrlTableSchema.CONTENT_DIGEST] = digest
+            item[UrlTableSchema.LAST_UPLOADED] = self.started
+            return FetchResult(item, page.status_code)
+        except FetchError as err:
+            traceback.print_exc()
+            metrics.count("FetchErrors")
+            return FetchResult(item, err.status_code, err)
         except Exception as err:
-            update_fetched_url(url)
-            self.errors.append(err)
             traceback.print_exc()
-        finally:
-            self.queue.task_done()
-
-    def process(self, items):
-        # Initialize Queue with sufficient size
-        self.queue = Queue(len(items) * 2)
-
-        # Create threads
-        for _ in range(len(items)):
-            t = Thread(target=self.consumer)
-            t.daemon = True
-            t.start()
+            return FetchResult(item, -1, err)
 
-        # Enqueue requests
-        for item in items:
-            self.queue.put(item)
+    def flush(self, results: List[FetchResult]):
+        """Writes the results' StatusCode/LastFetched and fetch state to UrlTable."""
+        unwritten = update_fetched_items([(result.item, result.status_code) for result in results])
+        unwritten_urls = {item[UrlTableSchema.URL] for item in unwritten}
+        for result in results:
+            if result.url in unwritten_urls and not result.error:
+                result.error = FetchResultNotWrittenError(result.url)
 
-        # Wait for all threads to finish
-        self.queue.join()
+    def process(self, items):
+        """Fetches the items concurrently, flushing every `flush_size` completed results, so a slow
+        batch that runs out of time has still recorded what it fetched."""
+        self.started = int(time.time())
+        self.results = [None] * len(items)
+        futures = {self.executor.submit(self.consumer, item): i for i, item in enumerate(items)}
+        completed = []
+        for future in as_completed(futures):
+            self.results[futures[future]] = future.result()
+            completed.append(future.result())
+            if len(completed) >= self.flush_size:
+                self.flush(completed)
+                completed = []
+        if completed:
+            self.flush(completed)
 
 
 def gather_batch():
-    sorted_items = sorted(get_all_url_items(), key=lambda x: x.get(UrlTableSchema.LAST_FETCHED, 0))
-    return sorted_items[:FETCH_BATCH_SIZE]
+    if FETCH_USE_INDEX:
+        return get_due_url_items(FETCH_BATCH_SIZE)
+    return heapq.nsmallest(
+        FETCH_BATCH_SIZE,
+        get_all_url_items(),
+        key=lambda x: x.get(UrlTableSchema.LAST_FETCHED, NEVER_FETCHED),
+    )
 
 
+@metrics.emits_metrics("PageFetcher")
 def handle(event, context=None):
     print(f"Triggered for event: {event}")
 
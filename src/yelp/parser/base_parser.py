@@ -1,14 +1,37 @@
+import time
 from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional, Union
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from yelp import metrics
 from yelp.parser.util import to_soup
+from yelp.persistence.yelp_table import is_batching
 
 
 class ParsedResult:
     pass
 
 
+def _timed_chunks(chunks: Iterable[str], waited: List[float]):
+    """Yields `chunks`, adding the seconds spent waiting on each one to `waited[0]`."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        waited[0] += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
 class BaseParser(ABC):
+    # Subtrees of the page that `parse` reads; None builds the whole tree
+    PARSE_ONLY: Optional[SoupStrainer] = None
+
+    def __init__(self, user_id: Optional[str] = None):
+        # UserId the page was fetched for, when the page was stored with it
+        self.user_id = user_id
+
     @abstractmethod
     def parse(self, url, soup: BeautifulSoup) -> ParsedResult:
         pass
@@ -17,9 +40,26 @@ class BaseParser(ABC):
     def write_result(self, url, result: ParsedResult):
         pass
 
-    def process(self, url: str, page: str):
-        soup = to_soup(page)
-        result = self.parse(url, soup)
+    def load(self, page: Union[str, Iterable[str]]):
+        """Turns the raw page into what `parse` expects. Parsers that don't need a tree
+        override it."""
+        return to_soup(page, parse_only=self.PARSE_ONLY)
+
+    def process(self, url: str, page: Union[str, Iterable[str]]):
+        # Streamed pages are read from S3 as they're parsed, which S3ReadLatency already covers
+        waited = [0.0]
+        if not isinstance(page, str):
+            page = _timed_chunks(page, waited)
+        start = time.perf_counter()
+        result = self.parse(url, self.load(page))
+        metrics.record(
+            f"{type(self).__name__}Time",
+            (time.perf_counter() - start - waited[0]) * 1000,
+            metrics.MILLISECONDS,
+        )
         print(f"Parsed result: {result}")
         self.write_result(url, result)
-        print("Wrote result to YelpTable.")
+        if is_batching():
+            print("Buffered result for YelpTable.")  # UpdateBatch.flush logs the write
+        else:
+            print("Wrote result to YelpTable.")
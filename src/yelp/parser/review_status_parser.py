@@ -1,7 +1,7 @@
 import re
 from dataclasses import dataclass
+from typing import Iterable, Union
 
-from bs4 import BeautifulSoup
 from yelp.parser.base_parser import BaseParser, ParsedResult
 from yelp.persistence.yelp_table import ReviewId, get_user_id_from_review_id, update_review_status
 
@@ -13,10 +13,13 @@ class ParsedReviewStatus(ParsedResult):
 
 
 class ReviewStatusParser(BaseParser):
-    def parse(self, url, soup: BeautifulSoup) -> ParsedReviewStatus:
-        html = str(soup)
+    def load(self, page: Union[str, Iterable[str]]):
+        # Only the presence of the review id matters, so skip building a soup entirely
+        return page
+
+    def parse(self, url, page: Union[str, Iterable[str]]) -> ParsedReviewStatus:
         review_id_tuple: ReviewId = ReviewStatusParser.get_review_id_from_url(url)
-        is_alive = ReviewStatusParser.review_id_on_page(html, review_id_tuple.review_id)
+        is_alive = ReviewStatusParser.review_id_on_page(page, review_id_tuple.review_id)
         return ParsedReviewStatus(
             review_id_tuple=review_id_tuple,
             is_alive=is_alive,
@@ -24,7 +27,7 @@ class ReviewStatusParser(BaseParser):
 
     def write_result(self, _, result: ParsedReviewStatus):
         update_review_status(
-            user_id=get_user_id_from_review_id(result.review_id_tuple.review_id),
+            user_id=self.user_id or get_user_id_from_review_id(result.review_id_tuple.review_id),
             review_id=result.review_id_tuple,
             status=result.is_alive,
         )
@@ -36,5 +39,16 @@ class ReviewStatusParser(BaseParser):
         return ReviewId(biz_id, review_id)
 
     @staticmethod
-    def review_id_on_page(page_text, review_id):
-        return bool(re.search(review_id, page_text))
+    def review_id_on_page(page: Union[str, Iterable[str]], review_id) -> bool:
+        """Literal substring search, carrying the end of each chunk over so that a review id split
+        across two chunks is still found."""
+        if isinstance(page, str):
+            return review_id in page
+        overlap = len(review_id) - 1
+        tail = ""
+        for chunk in page:
+            window = tail + chunk
+            if review_id in window:
+                return True
+            tail = window[-overlap:] if overlap else ""
+        return False
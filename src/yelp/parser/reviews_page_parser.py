@@ -1,10 +1,14 @@
 import re
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 from bs4 import BeautifulSoup
 from yelp.parser.base_parser import BaseParser, ParsedResult
-from yelp.parser.util import get_elements_by_classname
+from yelp.parser.util import (
+    class_strainer,
+    get_element_by_classname,
+    get_elements_by_classname,
+)
 from yelp.persistence.yelp_table import ReviewId, ReviewMetadata, upsert_review
 
 
@@ -23,6 +27,8 @@ class ParsedReviewsPage(ParsedResult):
 
 
 class ReviewsPageParser(BaseParser):
+    PARSE_ONLY = class_strainer("review")
+
     def parse(self, _, soup: BeautifulSoup) -> ParsedResult:
         return ParsedReviewsPage(reviews=ReviewsPageParser.get_user_biz_reviews(soup))
 
@@ -46,33 +52,44 @@ class ReviewsPageParser(BaseParser):
 
     @staticmethod
     def get_user_biz_reviews(soup) -> List[ParsedReviewMetadata]:
-        biz_elems = get_elements_by_classname(soup, "biz-name")
-        biz_ids = list(map(lambda elem: elem["href"].split("/")[-1], biz_elems))
-        biz_names = list(map(lambda elem: elem.get_text(), biz_elems))
-        biz_addresses = list(map(ReviewsPageParser.sanitize_address_elem, soup.find_all("address")))
-
-        review_ids = list(
-            map(lambda r: r["data-review-id"], get_elements_by_classname(soup, "review"))
-        )
+        scraped_reviews = []
+        for review_elem in get_elements_by_classname(soup, "review"):
+            if scraped := ReviewsPageParser.parse_review_elem(review_elem):
+                scraped_reviews.append(scraped)
+        return scraped_reviews
 
-        review_date_elems = get_elements_by_classname(soup, "rating-qualifier")
+    @staticmethod
+    def parse_review_elem(review_elem) -> Optional[ParsedReviewMetadata]:
+        """Extracts every field from within a single review container, so a review with a missing
+        field can't shift the fields of the reviews after it."""
+        biz_elem = get_element_by_classname(review_elem, "biz-name")
+        address_elem = review_elem.find("address")
 
         # Exclude dates from "Previous review"
-        review_date_elems = filter(
-            lambda e: "Previous review" not in e.get_text(), review_date_elems
+        review_date_match = next(
+            (
+                match
+                for elem in get_elements_by_classname(review_elem, "rating-qualifier")
+                if "Previous review" not in (text := elem.get_text())
+                and (match := re.search(ReviewsPageParser.DATE_REGEX, text))
+            ),
+            None,
         )
 
-        review_dates = list(
-            map(
-                lambda e: re.search(ReviewsPageParser.DATE_REGEX, e.get_text()).group(),
-                review_date_elems,
-            )
+        if biz_elem is None or review_date_match is None:
+            print(f"Skipping incomplete review. [review_id={review_elem.get('data-review-id')}]")
+            return None
+
+        return ParsedReviewMetadata(
+            biz_id=biz_elem["href"].split("/")[-1],
+            biz_name=biz_elem.get_text(),
+            biz_address=(
+                ReviewsPageParser.sanitize_address_elem(address_elem) if address_elem else ""
+            ),
+            review_id=review_elem["data-review-id"],
+            review_date=review_date_match.group(),
         )
 
-        tups = zip(biz_ids, biz_names, biz_addresses, review_ids, review_dates)
-        scraped_reviews = list(map(lambda tup: ParsedReviewMetadata(*tup), tups))
-        return scraped_reviews
-
     @staticmethod
     def get_user_id_from_url(url: str) -> str:
         return re.search(r"userid=([A-Za-z0-9-_]+)[\?&]?", url).group(1)
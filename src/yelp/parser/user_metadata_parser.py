@@ -3,7 +3,7 @@ from dataclasses import dataclass
 
 from bs4 import BeautifulSoup
 from yelp.parser.base_parser import BaseParser, ParsedResult
-from yelp.parser.util import get_element_by_classname
+from yelp.parser.util import class_strainer, get_element_by_classname
 from yelp.persistence.yelp_table import UserMetadata, upsert_metadata
 
 
@@ -15,6 +15,8 @@ class ParsedUserMetadata(ParsedResult):
 
 
 class UserMetadataParser(BaseParser):
+    PARSE_ONLY = class_strainer("user-profile_info", "user-location", "review-count")
+
     def parse(self, url, soup: BeautifulSoup) -> ParsedUserMetadata:
         return ParsedUserMetadata(
             name=UserMetadataParser.get_name(soup),
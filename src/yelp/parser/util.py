@@ -1,8 +1,86 @@
-from bs4 import BeautifulSoup
+import re
 
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import HTMLParserTreeBuilder
+from bs4.builder._htmlparser import BeautifulSoupHTMLParser
+from yelp.config import HTML_PARSER_BACKEND
 
-def to_soup(text):
-    return BeautifulSoup(text, "html.parser")
+HTML_PARSER = "html.parser"
+LXML = "lxml"
+
+
+class _ChunkedHTMLParserTreeBuilder(HTMLParserTreeBuilder):
+    """Tree builder that feeds html.parser one chunk at a time instead of one complete string."""
+
+    def __init__(self, chunks, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunks = chunks
+
+    def feed(self, markup):
+        args, kwargs = self.parser_args
+        try:
+            parser = BeautifulSoupHTMLParser(self.soup, *args, **kwargs)
+        except TypeError:  # beautifulsoup4 < 4.13 sets the soup after construction
+            parser = BeautifulSoupHTMLParser(*args, **kwargs)
+            parser.soup = self.soup
+        for chunk in self.chunks:
+            parser.feed(chunk)
+        parser.close()
+        parser.already_closed_empty_element = []
+
+
+# Backend name -> tree builder class that takes an iterable of chunks
+CHUNKED_TREE_BUILDERS = {HTML_PARSER: _ChunkedHTMLParserTreeBuilder}
+
+try:
+    from bs4.builder._lxml import LXMLTreeBuilder
+
+    class _ChunkedLXMLTreeBuilder(LXMLTreeBuilder):
+        """Tree builder that feeds lxml's HTML parser one chunk at a time."""
+
+        def __init__(self, chunks, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.chunks = chunks
+
+        def feed(self, markup):
+            self.parser = self.parser_for(self.soup.original_encoding)
+            for chunk in self.chunks:
+                self.parser.feed(chunk)
+            self.parser.close()
+
+    CHUNKED_TREE_BUILDERS[LXML] = _ChunkedLXMLTreeBuilder
+except ImportError:
+    pass
+
+
+def get_backend(name=HTML_PARSER_BACKEND):
+    """Returns `name` if that backend is installed, otherwise the pure Python html.parser."""
+    if name in CHUNKED_TREE_BUILDERS:
+        return name
+    print(
+        f"WARNING: HTML parser backend unavailable, falling back to {HTML_PARSER}. [backend={name}"
+        f", available={sorted(CHUNKED_TREE_BUILDERS)}]"
+    )
+    return HTML_PARSER
+
+
+BACKEND = get_backend()
+
+
+def class_strainer(*classnames) -> SoupStrainer:
+    """Keeps only the subtrees of elements that have any of the classes. Matches class tokens with a
+    regex since the strainer sees the raw, unsplit class attribute while the page is parsed."""
+    alternatives = "|".join(map(re.escape, classnames))
+    return SoupStrainer(class_=re.compile(rf"(^|\s)({alternatives})(\s|$)"))
+
+
+def to_soup(page, backend=None, parse_only: SoupStrainer = None):
+    """`page` is either the whole page or an iterable of its text chunks (see stream_page).
+    With `parse_only`, only the matching subtrees are built."""
+    backend = backend or BACKEND
+    if isinstance(page, (str, bytes)):
+        return BeautifulSoup(page, backend, parse_only=parse_only)
+    return BeautifulSoup("", builder=CHUNKED_TREE_BUILDERS[backend](page), parse_only=parse_only)
 
 
 def get_elements_by_classname(soup: BeautifulSoup, classname):
@@ -12,7 +90,4 @@ def get_elements_by_classname(soup: BeautifulSoup, classname):
 
 def get_element_by_classname(soup: BeautifulSoup, classname):
     """Use this method when there is exactly 1 element with the class."""
-    results = soup.find_all(class_=classname)
-    if len(results) == 0:
-        return None
-    return results[0]
+    return soup.find(class_=classname)
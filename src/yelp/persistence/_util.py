@@ -1,5 +1,234 @@
+import queue
+import threading
 import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from botocore.exceptions import ClientError
+from yelp.config import SCAN_TOTAL_SEGMENTS
+
+BATCH_WRITE_SIZE = 25
+TRANSACT_WRITE_SIZE = 100
+# Error codes worth retrying an UpdateItem for. Anything else (e.g. a ValidationException or a
+# failed condition) fails the same way on every attempt
+RETRYABLE_ERROR_CODES = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TransactionConflictException",
+    "InternalServerError",
+    "ServiceUnavailable",
+}
 
 
 def calculate_ttl(ttl) -> int:
     return int(time.time()) + int(ttl)
+
+
+def ttl_cache(maxsize=1024, ttl=3600):
+    """Like functools.lru_cache, but entries also expire `ttl` seconds after they were cached.
+    Calls that raise are not cached."""
+
+    def decorator(fn):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(fn)
+        def wrapper(*args):
+            now = time.monotonic()
+            with lock:
+                if args in cache:
+                    value, expires = cache[args]
+                    if now < expires:
+                        cache.move_to_end(args)
+                        return value
+                    del cache[args]
+            value = fn(*args)
+            with lock:
+                cache[args] = (value, now + ttl)
+                cache.move_to_end(args)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
+def _projection_kwargs(projection):
+    if not projection:
+        return {}
+    names = {f"#p{i}": name for i, name in enumerate(projection)}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+
+def query_items(table, key_condition, projection=None, **kwargs):
+    """Yields every item matching `key_condition`, following LastEvaluatedKey across result pages.
+    `projection` lists the attribute names to fetch instead of whole items."""
+    kwargs["KeyConditionExpression"] = key_condition
+    kwargs.update(_projection_kwargs(projection))
+    while True:
+        response = table.query(**kwargs)
+        yield from response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def parallel_scan(table, total_segments=SCAN_TOTAL_SEGMENTS, projection=None):
+    """Yields every item in the table, scanning `total_segments` segments concurrently. Items come
+    out as each segment's pages arrive, so they are in no particular order."""
+    pages = queue.Queue(maxsize=2 * total_segments)
+    stop = threading.Event()
+    segment_done = object()
+
+    def put(page):
+        # Gives up once the consumer has stopped reading, so workers don't block on a full queue
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan_segment(segment):
+        kwargs = {"Segment": segment, "TotalSegments": total_segments}
+        kwargs.update(_projection_kwargs(projection))
+        try:
+            while not stop.is_set():
+                response = table.scan(**kwargs)
+                put(response["Items"])
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        except Exception as e:
+            put(e)
+        finally:
+            put(segment_done)
+
+    with ThreadPoolExecutor(total_segments) as executor:
+        for segment in range(total_segments):
+            executor.submit(scan_segment, segment)
+        try:
+            remaining = total_segments
+            while remaining:
+                page = pages.get()
+                if page is segment_done:
+                    remaining -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield from page
+        finally:
+            stop.set()
+
+
+def _batch_write_chunk(table, pending, max_attempts, base_delay):
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(base_delay * 2 ** (attempt - 1))
+        response = table.meta.client.batch_write_item(RequestItems={table.name: pending})
+        pending = response.get("UnprocessedItems", {}).get(table.name, [])
+        if not pending:
+            break
+    return pending
+
+
+def batch_write_items(table, write_requests, max_attempts=5, base_delay=0.05, max_workers=1):
+    """Sends PutRequest/DeleteRequest dicts through BatchWriteItem, `max_workers` chunks at a time,
+    retrying unprocessed items with exponential backoff. Returns the requests that were still
+    unprocessed afterwards."""
+    chunks = [
+        write_requests[i : i + BATCH_WRITE_SIZE]
+        for i in range(0, len(write_requests), BATCH_WRITE_SIZE)
+    ]
+
+    def write_chunk(chunk):
+        return _batch_write_chunk(table, chunk, max_attempts, base_delay)
+
+    if max_workers > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers) as executor:
+            results = list(executor.map(write_chunk, chunks))
+    else:
+        results = map(write_chunk, chunks)
+    return [request for unprocessed in results for request in unprocessed]
+
+
+def _chunk_unique_keys(updates, size):
+    """Splits updates into chunks of at most `size` where no Key repeats, keeping the updates of a
+    key in order across chunks. A transaction can't touch the same item twice."""
+    chunks = []
+    for update in updates:
+        key = tuple(sorted(update["Key"].items()))
+        for chunk, keys in chunks:
+            if len(chunk) < size and key not in keys:
+                break
+        else:
+            chunk, keys = [], set()
+            chunks.append((chunk, keys))
+        chunk.append(update)
+        keys.add(key)
+    return [chunk for chunk, _ in chunks]
+
+
+def _update_item_with_retry(
+    table, update, max_attempts, base_delay, ignored_error_codes=()
+) -> bool:
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(base_delay * 2 ** (attempt - 1))
+        try:
+            table.update_item(**update)
+            return True
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code in ignored_error_codes:
+                print(f"Skipped update. [key={update['Key']}, {e=}]")
+                return True
+            traceback.print_exc()
+            if code not in RETRYABLE_ERROR_CODES:
+                return False
+    return False
+
+
+def parallel_update_items(
+    table, updates, max_workers, max_attempts=5, base_delay=0.05, ignored_error_codes=()
+):
+    """Sends update_item kwargs as concurrent UpdateItem calls, each retried on its own with
+    exponential backoff while it fails with one of RETRYABLE_ERROR_CODES. Updates failing with one
+    of `ignored_error_codes` (e.g. a condition that no longer holds) count as done. Returns the
+    updates that still failed."""
+    with ThreadPoolExecutor(max_workers) as executor:
+        succeeded = executor.map(
+            lambda update: _update_item_with_retry(
+                table, update, max_attempts, base_delay, ignored_error_codes
+            ),
+            updates,
+        )
+        return [update for update, ok in zip(updates, list(succeeded)) if not ok]
+
+
+def transact_update_items(table, updates, max_attempts=5, base_delay=0.05, ignored_error_codes=()):
+    """Sends update_item kwargs through TransactWriteItems. The updates of a chunk that fails are
+    retried one at a time with exponential backoff, where `ignored_error_codes` count as done (see
+    parallel_update_items). Returns the updates that still failed."""
+    failed = []
+    for chunk in _chunk_unique_keys(updates, TRANSACT_WRITE_SIZE):
+        try:
+            table.meta.client.transact_write_items(
+                TransactItems=[{"Update": {"TableName": table.name, **update}} for update in chunk]
+            )
+        except ClientError as e:
+            print(f"Transaction failed, retrying its {len(chunk)} update(s) one at a time. [{e=}]")
+            failed += [
+                update
+                for update in chunk
+                if not _update_item_with_retry(
+                    table, update, max_attempts, base_delay, ignored_error_codes
+                )
+            ]
+    return failed
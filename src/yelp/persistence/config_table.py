@@ -1,14 +1,20 @@
 import time
+from typing import Optional
 
 import boto3
-from yelp.config import CONFIG_TABLE_NAME
+from botocore.exceptions import ClientError
+from yelp import metrics
+from yelp.config import CONFIG_TABLE_NAME, SCAN_TOTAL_SEGMENTS
+from yelp.persistence._util import parallel_scan
 
 CONFIG_TABLE = boto3.resource("dynamodb").Table(CONFIG_TABLE_NAME)
+metrics.instrument(CONFIG_TABLE.meta.client)
 
 
 class ConfigTableSchema:
     USER_ID = "UserId"
     LAST_MODIFIED = "LastModified"
+    CLEANER_FINGERPRINT = "CleanerFingerprint"
 
 
 def upsert_user_id(user_id):
@@ -17,13 +23,33 @@ def upsert_user_id(user_id):
     )
 
 
-def get_all_user_ids():
-    response = CONFIG_TABLE.scan()
-    items = response["Items"]
-    while response.get("LastEvaluatedKey"):
-        response = CONFIG_TABLE.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-        items += response["Items"]
-    return list(map(lambda item: item[ConfigTableSchema.USER_ID], items))
+def get_all_user_ids(total_segments=SCAN_TOTAL_SEGMENTS):
+    items = parallel_scan(CONFIG_TABLE, total_segments, projection=[ConfigTableSchema.USER_ID])
+    return map(lambda item: item[ConfigTableSchema.USER_ID], items)
+
+
+def get_cleaner_fingerprint(user_id) -> Optional[str]:
+    item = CONFIG_TABLE.get_item(
+        Key={ConfigTableSchema.USER_ID: user_id},
+        ProjectionExpression="#fingerprint",
+        ExpressionAttributeNames={"#fingerprint": ConfigTableSchema.CLEANER_FINGERPRINT},
+    ).get("Item", {})
+    return item.get(ConfigTableSchema.CLEANER_FINGERPRINT)
+
+
+def set_cleaner_fingerprint(user_id, fingerprint: str):
+    try:
+        CONFIG_TABLE.update_item(
+            Key={ConfigTableSchema.USER_ID: user_id},
+            UpdateExpression=f"set {ConfigTableSchema.CLEANER_FINGERPRINT}=:fingerprint",
+            # Don't bring back a user that was deleted while the cleaner ran
+            ConditionExpression=f"attribute_exists({ConfigTableSchema.USER_ID})",
+            ExpressionAttributeValues={":fingerprint": fingerprint},
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        print(f"User no longer exists, fingerprint not stored. [{user_id=}]")
 
 
 def delete_user_id(user_id):
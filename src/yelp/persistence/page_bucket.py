@@ -1,9 +1,22 @@
+import codecs
+import gzip
+import time
+from typing import Dict, Iterator, Tuple
 from urllib.parse import quote_plus, unquote_plus
 
 import boto3
+from yelp import metrics
 from yelp.config import PAGE_BUCKET_NAME
 
 S3 = boto3.resource("s3")
+metrics.instrument(S3.meta.client)
+
+GZIP_ENCODING = "gzip"
+# Pages are highly compressible HTML, so a mid-level setting gets nearly all of the savings
+GZIP_COMPRESS_LEVEL = 6
+PAGE_CHUNK_SIZE = 64 * 1024
+# Object metadata key of the UserId that the page was fetched for
+USER_ID_METADATA = "user-id"
 
 
 class KeyUtils:
@@ -16,16 +29,85 @@ class KeyUtils:
         return unquote_plus(key)
 
 
-def upload_page(url, html: bytes):
+class _CountingReader:
+    """Counts the bytes read from the object body, i.e. before decompression."""
+
+    def __init__(self, body):
+        self.body = body
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.body.close()
+
+
+def _open_body(response):
+    """Returns the raw body's _CountingReader along with a file-like object that reads the
+    decompressed body. Objects uploaded before pages were compressed have no ContentEncoding and
+    are read as-is."""
+    raw = _CountingReader(response["Body"])
+    if response.get("ContentEncoding") == GZIP_ENCODING:
+        return raw, gzip.GzipFile(fileobj=raw, mode="rb")
+    return raw, raw
+
+
+def upload_page(url, html: bytes, user_id=None):
     key = KeyUtils.to_key(url)
     obj = S3.Object(PAGE_BUCKET_NAME, key)
-    obj.put(Body=html)
-    print(f"Uploaded page. [url={url}, length={len(html)}]")
+    body = gzip.compress(html, compresslevel=GZIP_COMPRESS_LEVEL)
+    metadata = {USER_ID_METADATA: user_id} if user_id else {}
+    obj.put(
+        Body=body,
+        ContentEncoding=GZIP_ENCODING,
+        ContentType="text/html; charset=utf-8",
+        Metadata=metadata,
+    )
+    metrics.count("S3BytesUploaded", len(body), metrics.BYTES)
+    print(f"Uploaded page. [url={url}, length={len(html)}, compressed_length={len(body)}]")
 
 
-def download_page(url):
+def open_page(url, chunk_size=PAGE_CHUNK_SIZE) -> Tuple[Dict[str, str], Iterator[str]]:
+    """Returns the page's object metadata along with its text chunks (see stream_page)."""
     key = KeyUtils.to_key(url)
     obj = S3.Object(PAGE_BUCKET_NAME, key)
-    html = obj.get()["Body"].read().decode("utf-8")
-    print(f"Downloaded page. [url={url}, length={len(html)}]")
-    return html
+    response = obj.get()
+    return response.get("Metadata", {}), _read_chunks(url, response, chunk_size)
+
+
+def stream_page(url, chunk_size=PAGE_CHUNK_SIZE):
+    """Yields the page as decoded text chunks, so neither the downloaded bytes nor the decoded
+    text of the whole page are ever held in memory at once."""
+    key = KeyUtils.to_key(url)
+    obj = S3.Object(PAGE_BUCKET_NAME, key)
+    yield from _read_chunks(url, obj.get(), chunk_size)
+
+
+def _read_chunks(url, response, chunk_size):
+    raw, body = _open_body(response)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    length = 0
+    read_seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            chunk = body.read(chunk_size)
+            read_seconds += time.perf_counter() - start
+            if not chunk:
+                break
+            length += len(chunk)
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+        print(f"Downloaded page. [url={url}, length={length}]")
+    finally:
+        # Also when the reader stops early, so the rest of the object isn't left on the connection
+        raw.close()
+        metrics.count("S3BytesDownloaded", raw.bytes_read, metrics.BYTES)
+        metrics.record("S3ReadLatency", read_seconds * 1000, metrics.MILLISECONDS)
+
+
+def download_page(url):
+    return "".join(stream_page(url))
@@ -1,13 +1,29 @@
 import re
 import time
 from enum import Enum
+from http import HTTPStatus
+from typing import Dict, List, Set
 
 import boto3
 from boto3.dynamodb.conditions import Key
-from yelp.config import URL_TABLE_NAME, URL_TABLE_TTL
-from yelp.persistence._util import calculate_ttl
+from yelp import metrics
+from yelp.config import (
+    SCAN_TOTAL_SEGMENTS,
+    URL_TABLE_NAME,
+    URL_TABLE_TTL,
+    URL_UPSERT_CONCURRENCY,
+)
+from yelp.persistence._util import (
+    batch_write_items,
+    calculate_ttl,
+    parallel_scan,
+    parallel_update_items,
+    query_items,
+    transact_update_items,
+)
 
 URL_TABLE = boto3.resource("dynamodb").Table(URL_TABLE_NAME)
+metrics.instrument(URL_TABLE.meta.client)
 
 
 class UrlTableSchema:
@@ -17,6 +33,19 @@ class UrlTableSchema:
     LAST_FETCHED = "LastFetched"
     STATUS_CODE = "StatusCode"
     TTL = "TimeToLive"
+    FETCH_BUCKET = "FetchBucket"
+    ETAG = "ETag"
+    LAST_MODIFIED = "LastModified"
+    LAST_UPLOADED = "LastUploaded"
+    CONTENT_DIGEST = "ContentDigest"
+
+
+KEY_ATTRIBUTES = [UrlTableSchema.USER_ID, UrlTableSchema.SORT_KEY]
+
+# Every fetchable URL shares one FetchBucket so the FetchBucket GSI (sort key LastFetched) orders
+# all of them by when they were last fetched
+FETCH_BUCKET_VALUE = "Fetch"
+NEVER_FETCHED = 0
 
 
 class UrlType(Enum):
@@ -53,31 +82,89 @@ def get_sort_key_from_url(url):
         return f"{sort_key_prefix}#{biz_id}"
 
 
-def get_all_url_items():
+def get_all_url_items(total_segments=SCAN_TOTAL_SEGMENTS, projection=None):
+    return parallel_scan(URL_TABLE, total_segments, projection)
+
+
+def get_due_url_items(limit):
+    """Returns up to `limit` items, least recently fetched first, from the FetchBucket GSI."""
     items = []
-    response = URL_TABLE.scan()
-    items = response["Items"]
-    while response.get("LastEvaluatedKey"):
-        response = URL_TABLE.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
+    kwargs = {
+        "IndexName": UrlTableSchema.FETCH_BUCKET,
+        "KeyConditionExpression": Key(UrlTableSchema.FETCH_BUCKET).eq(FETCH_BUCKET_VALUE),
+        "ScanIndexForward": True,
+    }
+    while len(items) < limit:
+        response = URL_TABLE.query(Limit=limit - len(items), **kwargs)
         items += response["Items"]
+        if not response.get("LastEvaluatedKey"):
+            break
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
     return items
 
 
-def upsert_new_url(user_id, url, ttl=URL_TABLE_TTL):
-    URL_TABLE.update_item(
-        Key={
+def _new_url_update(user_id, url, ttl):
+    return {
+        "Key": {
             UrlTableSchema.USER_ID: user_id,
             UrlTableSchema.SORT_KEY: get_sort_key_from_url(url),
         },
-        UpdateExpression=f"set {UrlTableSchema.URL}=:url, {UrlTableSchema.TTL}=:ttl",
-        ExpressionAttributeValues={
+        "UpdateExpression": (
+            f"set {UrlTableSchema.URL}=:url"
+            f", {UrlTableSchema.TTL}=:ttl"
+            f", {UrlTableSchema.FETCH_BUCKET}=:fetch_bucket"
+            f", {UrlTableSchema.LAST_FETCHED}=if_not_exists({UrlTableSchema.LAST_FETCHED}, :never)"
+        ),
+        "ExpressionAttributeValues": {
             ":url": url,
             ":ttl": calculate_ttl(ttl),
+            ":fetch_bucket": FETCH_BUCKET_VALUE,
+            ":never": NEVER_FETCHED,
         },
-    )
+    }
+
+
+def upsert_new_url(user_id, url, ttl=URL_TABLE_TTL):
+    URL_TABLE.update_item(**_new_url_update(user_id, url, ttl))
     print(f"Upserted new URL. [{user_id=}, {url=}]")
 
 
+def upsert_new_urls(user_id, urls: List[str], ttl=URL_TABLE_TTL) -> List[str]:
+    """Upserts the URLs concurrently. UpdateItem rather than BatchWriteItem, since a put would wipe
+    the fetch state of URLs that are already tracked. Returns the URLs that failed."""
+    updates = [_new_url_update(user_id, url, ttl) for url in urls]
+    failed = parallel_update_items(URL_TABLE, updates, URL_UPSERT_CONCURRENCY)
+    failed_urls = [update["ExpressionAttributeValues"][":url"] for update in failed]
+    print(f"Upserted new URLs. [{user_id=}, count={len(urls)}, failed={len(failed_urls)}]")
+    return failed_urls
+
+
+def get_url_ttls(user_id) -> Dict[str, int]:
+    """Returns PageUrl -> TimeToLive of every URL tracked for the user. URLs written before the
+    FetchBucket GSI existed map to 0, so that they count as expiring and get upserted into it."""
+    projection = [UrlTableSchema.URL, UrlTableSchema.TTL, UrlTableSchema.FETCH_BUCKET]
+    return {
+        item[UrlTableSchema.URL]: (
+            int(item.get(UrlTableSchema.TTL, 0)) if UrlTableSchema.FETCH_BUCKET in item else 0
+        )
+        for item in iter_records(user_id, projection=projection)
+        if UrlTableSchema.URL in item
+    }
+
+
+def get_recently_fetched_urls(user_id, max_age) -> Set[str]:
+    """Returns the user's PageUrls that were fetched with a 200 or 304 within the last `max_age`
+    seconds, i.e. whose page in PageBucket was current as of then."""
+    fetched_after = int(time.time()) - max_age
+    projection = [UrlTableSchema.URL, UrlTableSchema.LAST_FETCHED, UrlTableSchema.STATUS_CODE]
+    return {
+        item[UrlTableSchema.URL]
+        for item in iter_records(user_id, projection=projection)
+        if item.get(UrlTableSchema.LAST_FETCHED, NEVER_FETCHED) >= fetched_after
+        and item.get(UrlTableSchema.STATUS_CODE) in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED)
+    }
+
+
 class MultipleUserIdsFoundError(Exception):
     pass
 
@@ -95,27 +182,67 @@ def get_user_id_from_url(url):
     return items[0][UrlTableSchema.USER_ID]
 
 
-def update_fetched_url(url, status_code=-1):
-    user_id, sort_key = get_user_id_from_url(url), get_sort_key_from_url(url)
-    URL_TABLE.update_item(
-        Key={
-            UrlTableSchema.USER_ID: user_id,
-            UrlTableSchema.SORT_KEY: sort_key,
-        },
-        UpdateExpression=(
-            f"set {UrlTableSchema.STATUS_CODE}=:status_code"
-            f", {UrlTableSchema.LAST_FETCHED}=:last_fetched"
-        ),
-        ExpressionAttributeValues={
-            ":status_code": int(status_code),
-            ":last_fetched": int(time.time()),
-        },
+# Attributes page_fetcher owns, written back as they are in the fetched item and removed when absent
+FETCH_STATE_ATTRIBUTES = [
+    UrlTableSchema.ETAG,
+    UrlTableSchema.LAST_MODIFIED,
+    UrlTableSchema.CONTENT_DIGEST,
+    UrlTableSchema.LAST_UPLOADED,
+]
+
+
+def _fetched_update(item, status_code, last_fetched):
+    values = {":status_code": int(status_code), ":last_fetched": last_fetched}
+    sets = [
+        f"{UrlTableSchema.STATUS_CODE}=:status_code",
+        f"{UrlTableSchema.LAST_FETCHED}=:last_fetched",
+    ]
+    removes = []
+    for attr in FETCH_STATE_ATTRIBUTES:
+        if attr in item:
+            sets.append(f"{attr}=:{attr}")
+            values[f":{attr}"] = item[attr]
+        else:
+            removes.append(attr)
+    return {
+        "Key": {key: item[key] for key in KEY_ATTRIBUTES},
+        "UpdateExpression": f"set {', '.join(sets)}"
+        + (f" remove {', '.join(removes)}" if removes else ""),
+        # A URL deleted mid-batch (cleaner, DELETE /users/{id}) must stay deleted
+        "ConditionExpression": f"attribute_exists({UrlTableSchema.USER_ID})",
+        "ExpressionAttributeValues": values,
+    }
+
+
+def update_fetched_items(fetched):
+    """Takes (item, status_code) pairs of items read from UrlTable and writes their StatusCode,
+    LastFetched and fetch state through TransactWriteItems, 100 updates per request. Updates rather
+    than puts, so attributes other writers changed meanwhile (e.g. TimeToLive) are kept. Returns
+    the items that could not be written."""
+    last_fetched = int(time.time())
+    updates = [_fetched_update(item, status_code, last_fetched) for item, status_code in fetched]
+    failed = transact_update_items(
+        URL_TABLE, updates, ignored_error_codes=("ConditionalCheckFailedException",)
     )
-    print(f"Updated fetched URL. [{user_id=}, {sort_key=}, {url=}, {status_code=}]")
+    failed_keys = {tuple(update["Key"].values()) for update in failed}
+    unwritten = [
+        item for item, _ in fetched if tuple(item[key] for key in KEY_ATTRIBUTES) in failed_keys
+    ]
+    print(f"Updated fetched items. [count={len(fetched)}, unwritten={len(unwritten)}]")
+    return unwritten
+
+
+def iter_records(user_id, sort_key_prefix=None, projection=None):
+    """Streams the user's records, optionally only those whose SortKey starts with
+    `sort_key_prefix` and only the `projection` attributes of each."""
+    key_condition = Key(UrlTableSchema.USER_ID).eq(user_id)
+    if sort_key_prefix:
+        key_condition &= Key(UrlTableSchema.SORT_KEY).begins_with(sort_key_prefix)
+    return query_items(URL_TABLE, key_condition, projection)
 
 
 def get_all_records(user_id):
-    return URL_TABLE.query(KeyConditionExpression=Key(UrlTableSchema.USER_ID).eq(user_id))["Items"]
+    return list(iter_records(user_id))
 
 
 def delete_records(records):
@@ -131,5 +258,20 @@ def delete_records(records):
             batch.delete_item(Key=key)
 
 
+def delete_sort_keys(user_id, sort_keys: List[str], max_workers=1) -> List[str]:
+    """Deletes the user's records with these sort keys in BatchWriteItem chunks, `max_workers`
+    chunks at a time. Returns the sort keys that could not be deleted."""
+    write_requests = [
+        {
+            "DeleteRequest": {
+                "Key": {UrlTableSchema.USER_ID: user_id, UrlTableSchema.SORT_KEY: sort_key}
+            }
+        }
+        for sort_key in sort_keys
+    ]
+    unprocessed = batch_write_items(URL_TABLE, write_requests, max_workers=max_workers)
+    return [request["DeleteRequest"]["Key"][UrlTableSchema.SORT_KEY] for request in unprocessed]
+
+
 def delete_user_id(user_id):
-    delete_records(get_all_records(user_id))
+    delete_records(iter_records(user_id, projection=KEY_ATTRIBUTES))
@@ -1,12 +1,24 @@
 import time
 from collections import namedtuple
+from contextlib import contextmanager
+from threading import Lock
+from typing import List
 
 import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from yelp import metrics
 from yelp.config import YELP_TABLE_NAME, YELP_TABLE_TTL
-from yelp.persistence._util import calculate_ttl
+from yelp.persistence._util import (
+    batch_write_items,
+    calculate_ttl,
+    query_items,
+    transact_update_items,
+    ttl_cache,
+)
 
 YELP_TABLE = boto3.resource("dynamodb").Table(YELP_TABLE_NAME)
+metrics.instrument(YELP_TABLE.meta.client)
 
 
 class _YelpTableSchema:
@@ -16,6 +28,9 @@ class _YelpTableSchema:
     TTL = "TimeToLive"
 
 
+KEY_ATTRIBUTES = [_YelpTableSchema.USER_ID, _YelpTableSchema.SORT_KEY]
+
+
 class _MetadataSchema(_YelpTableSchema):
     SORT_KEY_VALUE = "Metadata"
     NAME = "UserName"
@@ -38,7 +53,13 @@ ReviewId = namedtuple("ReviewId", "biz_id review_id")
 ReviewMetadata = namedtuple("ReviewMetadata", "biz_name biz_address review_date")
 
 
-def _upsert_record(user_id, sort_key, update_expression, expression_attribute_values):
+# Updates whose ConditionExpression no longer holds are dropped rather than failed
+IGNORED_ERROR_CODES = ("ConditionalCheckFailedException",)
+
+
+def _upsert_record(
+    user_id, sort_key, update_expression, expression_attribute_values, condition_expression=None
+):
     update_expression += ", LastUpdated=:last_updated"
     expression_attribute_values[":last_updated"] = int(time.time())
     kwargs = {
@@ -46,14 +67,77 @@ def _upsert_record(user_id, sort_key, update_expression, expression_attribute_va
         "UpdateExpression": update_expression,
         "ExpressionAttributeValues": expression_attribute_values,
     }
-    YELP_TABLE.update_item(**kwargs)
+    if condition_expression:
+        kwargs["ConditionExpression"] = condition_expression
+    if _BATCH is not None:
+        _BATCH.add(kwargs)
+        return
+    try:
+        YELP_TABLE.update_item(**kwargs)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in IGNORED_ERROR_CODES:
+            raise
+        print(f"Skipped update, condition no longer holds. [{kwargs=}]")
+        return
     print(f"Updated {YELP_TABLE_NAME}. [{kwargs=}]")
 
 
+class UpdateBatch:
+    """Collects the updates of _upsert_record from any thread until they are flushed together."""
+
+    def __init__(self):
+        self.updates = []
+        self.failures = []
+        self._lock = Lock()
+
+    def add(self, update):
+        with self._lock:
+            self.updates.append(update)
+
+    def flush(self):
+        with self._lock:
+            updates, self.updates = self.updates, []
+        if updates:
+            failures = transact_update_items(
+                YELP_TABLE, updates, ignored_error_codes=IGNORED_ERROR_CODES
+            )
+            self.failures += failures
+            print(f"Updated {YELP_TABLE_NAME}. [updates={len(updates)}, failures={len(failures)}]")
+
+
+# Set while inside batch_updates(), which makes _upsert_record buffer instead of writing
+_BATCH = None
+
+
+def is_batching() -> bool:
+    """Whether upserts are currently buffered by batch_updates() rather than written."""
+    return _BATCH is not None
+
+
+@contextmanager
+def batch_updates():
+    """Buffers every upsert made inside the block and writes them on exit. Updates that could not
+    be written are left in the yielded batch's `failures`."""
+    global _BATCH
+    _BATCH = batch = UpdateBatch()
+    try:
+        yield batch
+    finally:
+        _BATCH = None
+        batch.flush()
+
+
+def iter_records(user_id, sort_key_prefix=None, projection=None):
+    """Streams the user's records, optionally only those whose SortKey starts with
+    `sort_key_prefix` and only the `projection` attributes of each."""
+    key_condition = Key(_YelpTableSchema.USER_ID).eq(user_id)
+    if sort_key_prefix:
+        key_condition &= Key(_YelpTableSchema.SORT_KEY).begins_with(sort_key_prefix)
+    return query_items(YELP_TABLE, key_condition, projection)
+
+
 def get_all_records(user_id):
-    return YELP_TABLE.query(KeyConditionExpression=Key(_YelpTableSchema.USER_ID).eq(user_id))[
-        "Items"
-    ]
+    return list(iter_records(user_id))
 
 
 def upsert_metadata(user_id, user_metadata: UserMetadata, ttl=YELP_TABLE_TTL):
@@ -106,6 +190,9 @@ def update_review_status(user_id, review_id: ReviewId, status):
         f"{_ReviewSchema.SORT_KEY_VALUE}#{review_id.biz_id}",
         (f"set {_ReviewSchema.REVIEW_STATUS}=:status"),
         {":status": status},
+        # The cleaner may have deleted the review while its page was being parsed, and a status
+        # alone would leave a stub record without BizId, ReviewId or TimeToLive
+        f"attribute_exists({_ReviewSchema.REVIEW_ID})",
     )
 
 
@@ -117,6 +204,8 @@ class MultipleUserIdsFoundError(Exception):
     pass
 
 
+# A ReviewId always belongs to the same UserId, the TTL only bounds how long a deleted user lingers
+@ttl_cache(maxsize=4096, ttl=3600)
 def get_user_id_from_review_id(review_id: str):
     items = YELP_TABLE.query(
         KeyConditionExpression=Key(_ReviewSchema.REVIEW_ID).eq(review_id),
@@ -144,5 +233,20 @@ def delete_records(records):
             batch.delete_item(Key=key)
 
 
+def delete_sort_keys(user_id, sort_keys: List[str], max_workers=1) -> List[str]:
+    """Deletes the user's records with these sort keys in BatchWriteItem chunks, `max_workers`
+    chunks at a time. Returns the sort keys that could not be deleted."""
+    write_requests = [
+        {
+            "DeleteRequest": {
+                "Key": {_YelpTableSchema.USER_ID: user_id, _YelpTableSchema.SORT_KEY: sort_key}
+            }
+        }
+        for sort_key in sort_keys
+    ]
+    unprocessed = batch_write_items(YELP_TABLE, write_requests, max_workers=max_workers)
+    return [request["DeleteRequest"]["Key"][_YelpTableSchema.SORT_KEY] for request in unprocessed]
+
+
 def delete_user_id(user_id):
-    delete_records(get_all_records(user_id))
+    delete_records(iter_records(user_id, projection=KEY_ATTRIBUTES))
@@ -1,17 +1,24 @@
+import time
 import traceback
-from typing import Dict
+from typing import Dict, Iterable, List
 
 import boto3
 
-from yelp.config import CONFIG_TABLE_NAME, YELP_TABLE_NAME
+from yelp import metrics
+from yelp.config import (
+    CONFIG_TABLE_NAME,
+    CRON_FULL_REFRESH,
+    URL_TTL_REFRESH_WINDOW,
+    YELP_TABLE_NAME,
+)
 from yelp.persistence.config_table import ConfigTableSchema, get_all_user_ids
-from yelp.persistence.url_table import UrlType, upsert_new_url
+from yelp.persistence.url_table import UrlType, get_url_ttls, upsert_new_url, upsert_new_urls
 from yelp.persistence.yelp_table import (
     _MetadataSchema,
     _ReviewSchema,
     _YelpTableSchema,
-    get_all_records,
     get_user_id_from_review_id,
+    iter_records,
 )
 
 USER_METADATA_URL = "https://www.yelp.com/user_details?userid={}"
@@ -20,12 +27,34 @@ REVIEW_STATUS_URL = "https://www.yelp.com/biz/{}?hrid={}"
 
 DDB_TYPE_DESERIALIZER = boto3.dynamodb.types.TypeDeserializer()
 
+# YelpTable attributes the cron reads to derive URLs
+CRON_PROJECTION = [
+    _YelpTableSchema.USER_ID,
+    _YelpTableSchema.SORT_KEY,
+    _MetadataSchema.REVIEW_COUNT,
+    _ReviewSchema.BIZ_ID,
+    _ReviewSchema.REVIEW_ID,
+]
+
+
+class UrlUpsertError(Exception):
+    pass
+
+
+def _upsert_urls(user_id, urls):
+    metrics.count("UrlsUpserted", len(urls))
+    if failed_urls := upsert_new_urls(user_id, urls):
+        raise UrlUpsertError(
+            f"Failed to upsert {len(failed_urls)} URL(s). [{user_id=}, {failed_urls=}]"
+        )
+
 
 def get_user_metadata_url(user_id):
     return USER_METADATA_URL.format(user_id)
 
 
 def _create_user_metadata_url(user_id: str):
+    metrics.count("UrlsUpserted")
     upsert_new_url(user_id, get_user_metadata_url(user_id))
 
 
@@ -37,31 +66,65 @@ def _create_user_review_pages_urls(user_metadata_record: Dict):
     if user_metadata_record:
         user_id = user_metadata_record.get(_YelpTableSchema.USER_ID)
         review_count = int(user_metadata_record.get(_MetadataSchema.REVIEW_COUNT))
-        for url in get_user_review_page_urls(user_id, review_count):
-            upsert_new_url(user_id, url)
+        _upsert_urls(user_id, get_user_review_page_urls(user_id, review_count))
+
+
+def get_review_status_url(review_record: Dict):
+    biz_id = review_record.get(_ReviewSchema.BIZ_ID)
+    review_id = review_record.get(_ReviewSchema.REVIEW_ID)
+    return REVIEW_STATUS_URL.format(biz_id, review_id)
 
 
 def _create_review_status_url(review_record: Dict):
     if review_record:
-        biz_id = review_record.get(_ReviewSchema.BIZ_ID)
         review_id = review_record.get(_ReviewSchema.REVIEW_ID)
-        user_id = get_user_id_from_review_id(review_id)
-        upsert_new_url(user_id, REVIEW_STATUS_URL.format(biz_id, review_id))
+        # Review records are keyed by UserId, so the ReviewId index is only a fallback
+        user_id = review_record.get(_YelpTableSchema.USER_ID)
+        if not user_id:
+            user_id = get_user_id_from_review_id(review_id)
+        metrics.count("UrlsUpserted")
+        upsert_new_url(user_id, get_review_status_url(review_record))
+
+
+def derive_urls(user_id, records: Iterable[Dict]) -> List[str]:
+    """Returns every URL to track for the user, given all of the user's YelpTable records."""
+    # () => Metadata URL
+    urls = [get_user_metadata_url(user_id)]
+    for record in records:
+        if record.get(_YelpTableSchema.SORT_KEY) == _MetadataSchema.SORT_KEY_VALUE:
+            # (MetadataRecord) => Review Page URLs
+            review_count = int(record.get(_MetadataSchema.REVIEW_COUNT))
+            urls += get_user_review_page_urls(user_id, review_count)
+        elif record.get(_YelpTableSchema.SORT_KEY).startswith(_ReviewSchema.SORT_KEY_VALUE):
+            # (ReviewRecord) => Biz Review Status URL
+            urls.append(get_review_status_url(record))
+    return urls
+
+
+def get_urls_to_upsert(user_id, urls: List[str]) -> List[str]:
+    """Only URLs that aren't tracked yet, aren't in the FetchBucket GSI yet, or that expire within
+    URL_TTL_REFRESH_WINDOW. The DynamoDB stream already upserts URLs for changed records, so the
+    rest need no write."""
+    url_ttls = get_url_ttls(user_id)
+    refresh_before = int(time.time()) + URL_TTL_REFRESH_WINDOW
+    return [url for url in urls if url_ttls.get(url, 0) < refresh_before]
 
 
 def handle_cron_event():
+    errors = []
     for user_id in get_all_user_ids():
-        # () => Metadata URL
-        _create_user_metadata_url(user_id)
-
-        for record in get_all_records(user_id):
-            print(f"UserId: {user_id}, record: {record}")
-            if record.get(_YelpTableSchema.SORT_KEY) == _MetadataSchema.SORT_KEY_VALUE:
-                # (MetadataRecord) => Review Page URLs
-                _create_user_review_pages_urls(record)
-            elif record.get(_YelpTableSchema.SORT_KEY).startswith(_ReviewSchema.SORT_KEY_VALUE):
-                # (ReviewRecord) => Biz Review Status URL
-                _create_review_status_url(record)
+        urls = derive_urls(user_id, iter_records(user_id, projection=CRON_PROJECTION))
+        to_upsert = urls if CRON_FULL_REFRESH else get_urls_to_upsert(user_id, urls)
+        print(f"Upserting URLs. [{user_id=}, total={len(urls)}, upserting={len(to_upsert)}]")
+        try:
+            _upsert_urls(user_id, to_upsert)
+        except UrlUpsertError as e:
+            traceback.print_exc()
+            errors.append(e)
+    if errors:
+        raise Exception(
+            f"Encountered {len(errors)} total error(s) during processing. See execution log for errors."
+        )
 
 
 def _parse_ddb_record(record):
@@ -78,6 +141,9 @@ def handle_yelp_table_record(ddb_record):
     if ddb_record["SortKey"] == _MetadataSchema.SORT_KEY_VALUE:
         _create_user_review_pages_urls(ddb_record)
     elif ddb_record["SortKey"].startswith(_ReviewSchema.SORT_KEY_VALUE):
+        if _ReviewSchema.BIZ_ID not in ddb_record or _ReviewSchema.REVIEW_ID not in ddb_record:
+            print(f"Skipping incomplete review record. [{ddb_record=}]")
+            return
         _create_review_status_url(ddb_record)
 
 
@@ -92,7 +158,9 @@ def handle_ddb_event(event):
             print(f"Processing DDB record: {event_record}")
 
             if CONFIG_TABLE_NAME in event_record["eventSourceARN"]:
-                handle_config_table_record(ddb_record)
+                # Only new users need URLs. A MODIFY is e.g. the cleaner storing its fingerprint
+                if event_record["eventName"] == "INSERT":
+                    handle_config_table_record(ddb_record)
             if YELP_TABLE_NAME in event_record["eventSourceARN"]:
                 handle_yelp_table_record(ddb_record)
 
@@ -105,6 +173,7 @@ def handle_ddb_event(event):
         )
 
 
+@metrics.emits_metrics("UrlRequester")
 def handle(event, context=None):
     print(f"Triggered for event: {event}")
     if event.get("source") == "aws.events":
@@ -1,94 +1,195 @@
-import json
 import time
+import traceback
 from concurrent.futures import ThreadPoolExecutor
-from typing import List
-
+from functools import partial
+from threading import BoundedSemaphore
+from typing import Iterable, Iterator, List, Set
+
+from botocore.exceptions import ClientError
+from yelp import metrics
+from yelp.config import (
+    CLEANER_DELETE_CONCURRENCY,
+    CLEANER_DRY_RUN,
+    CLEANER_MAX_IN_FLIGHT,
+    CLEANER_PAGE_MAX_AGE,
+    CLEANER_USER_CONCURRENCY,
+)
 from yelp.page_fetcher import fetch
-from yelp.parser.reviews_page_parser import ReviewsPageParser
+from yelp.parser.reviews_page_parser import ParsedReviewMetadata, ReviewsPageParser
 from yelp.parser.user_metadata_parser import UserMetadataParser
 from yelp.parser.util import to_soup
 from yelp.persistence import url_table, yelp_table
-from yelp.persistence.config_table import get_all_user_ids
+from yelp.persistence.config_table import (
+    get_all_user_ids,
+    get_cleaner_fingerprint,
+    set_cleaner_fingerprint,
+)
+from yelp.persistence.page_bucket import stream_page
 from yelp.persistence.yelp_table import ReviewId
 from yelp.url_requester import get_user_metadata_url, get_user_review_page_urls
 
+# Users are processed on USER_EXECUTOR, and every user's review page fetches share FETCH_EXECUTOR
+# (and page_fetcher's HTTP session), so the fan-out doesn't multiply with the user count
+USER_EXECUTOR = ThreadPoolExecutor(CLEANER_USER_CONCURRENCY)
+FETCH_EXECUTOR = ThreadPoolExecutor(CLEANER_MAX_IN_FLIGHT)
+IN_FLIGHT = BoundedSemaphore(CLEANER_MAX_IN_FLIGHT)
+
+
+class YelpCleanerError(Exception):
+    pass
+
 
-def emit_emf_metric(url_records_deleted, yelp_records_deleted):
-    emf = {
-        "_aws": {
-            "CloudWatchMetrics": [
-                {
-                    "Namespace": "YelpOrchestrator",
-                    "Dimensions": [],
-                    "Metrics": [
-                        {"Name": "UrlTableRecordsDeleted", "Unit": "Count"},
-                        {"Name": "YelpTableRecordsDeleted", "Unit": "Count"},
-                    ],
-                }
-            ],
-            "Timestamp": int(time.time()) * 1000,
-        },
-        "UrlTableRecordsDeleted": url_records_deleted,
-        "YelpTableRecordsDeleted": yelp_records_deleted,
-    }
-    print(json.dumps(emf))
-
-
-def fetch_soup(url):
-    return to_soup(fetch(url))
-
-
-def fetch_review_count(user_id):
-    soup = fetch_soup(get_user_metadata_url(user_id))
+def fetch_soup(url, fresh_urls: Set[str] = frozenset(), parse_only=None):
+    """Reads the page stored in PageBucket when `url` is one of `fresh_urls` (see
+    url_table.get_recently_fetched_urls), and only fetches it from Yelp otherwise."""
+    if url in fresh_urls:
+        try:
+            return to_soup(stream_page(url), parse_only=parse_only)
+        except ClientError as e:
+            print(f"Stored page unavailable, fetching from Yelp instead. [{url=}, {e=}]")
+    with IN_FLIGHT:
+        page = fetch(url)
+    return to_soup(page, parse_only=parse_only)
+
+
+def fetch_review_count(user_id, fresh_urls: Set[str] = frozenset()):
+    soup = fetch_soup(get_user_metadata_url(user_id), fresh_urls, UserMetadataParser.PARSE_ONLY)
     return UserMetadataParser.get_review_count(soup)
 
 
-def fetch_biz_ids(review_page_url):
-    soup = fetch_soup(review_page_url)
-    return [parsed_review.biz_id for parsed_review in ReviewsPageParser.get_user_biz_reviews(soup)]
+def fetch_reviews(review_page_url, fresh_urls: Set[str] = frozenset()):
+    soup = fetch_soup(review_page_url, fresh_urls, ReviewsPageParser.PARSE_ONLY)
+    return ReviewsPageParser.get_user_biz_reviews(soup)
 
 
-def get_biz_ids(user_id) -> List[ReviewId]:
-    review_count = fetch_review_count(user_id)
-    review_page_urls = get_user_review_page_urls(user_id, review_count)
+def fetch_biz_ids(review_page_url, fresh_urls: Set[str] = frozenset()):
+    return [parsed_review.biz_id for parsed_review in fetch_reviews(review_page_url, fresh_urls)]
+
 
+def get_biz_ids(review_page_urls, fresh_urls: Set[str] = frozenset()) -> List[ReviewId]:
     result = []
-    with ThreadPoolExecutor(max_workers=8) as tp:
-        for sub_result in tp.map(fetch_biz_ids, review_page_urls):
-            result += sub_result
+    fetch_page_biz_ids = partial(fetch_biz_ids, fresh_urls=fresh_urls)
+    for sub_result in FETCH_EXECUTOR.map(fetch_page_biz_ids, review_page_urls):
+        result += sub_result
 
     return result
 
 
-def cleanup_table(user_id, biz_ids, table, sort_key_prefix):
-    current_sort_keys = set([sort_key_prefix + biz_id for biz_id in biz_ids])
-    all_review_status_urls = filter(
-        lambda record: record["SortKey"].startswith(sort_key_prefix),
-        table.get_all_records(user_id),
+def get_fingerprint(review_count, first_page_reviews: List[ParsedReviewMetadata]) -> str:
+    """Changes whenever a review is added or removed, since reviews are listed newest first."""
+    newest_review_id = first_page_reviews[0].review_id if first_page_reviews else ""
+    return f"{review_count}#{newest_review_id}"
+
+
+def diff_sorted(stored: Iterable[str], current: List[str]) -> Iterator[str]:
+    """Yields the keys in `stored` that aren't in `current`, in one merge pass over both. Both must
+    be in ascending order, which is how Query returns sort keys."""
+    current = iter(current)
+    current_key = next(current, None)
+    for key in stored:
+        while current_key is not None and current_key < key:
+            current_key = next(current, None)
+        if key != current_key:
+            yield key
+
+
+# Tables the cleaner deletes stale reviews from, with the SortKey prefix that precedes a biz id
+CLEANUP_TABLES = ((url_table, "SortKey#ReviewStatusPage#"), (yelp_table, "Review#"))
+
+
+def find_stale_sort_keys(user_id, biz_ids, table, sort_key_prefix) -> List[str]:
+    """Returns the sort keys of the user's records under `sort_key_prefix` whose biz id isn't one
+    of `biz_ids`."""
+    current_sort_keys = sorted(sort_key_prefix + biz_id for biz_id in biz_ids)
+    stored_sort_keys = (
+        record["SortKey"]
+        for record in table.iter_records(user_id, sort_key_prefix, projection=["SortKey"])
     )
-    records_to_delete = list(
-        filter(
-            lambda record: record["SortKey"] not in current_sort_keys,
-            all_review_status_urls,
+    return list(diff_sorted(stored_sort_keys, current_sort_keys))
+
+
+def delete_stale_sort_keys(user_id, stale_sort_keys, table) -> List[str]:
+    started = time.perf_counter()
+    count = len(stale_sort_keys)
+
+    if CLEANER_DRY_RUN:
+        print(
+            f"Dry run, would delete from {table.__name__}. [{user_id=}, {count=}"
+            f", sort_keys={stale_sort_keys}]"
         )
+        return stale_sort_keys
+
+    if undeleted := table.delete_sort_keys(user_id, stale_sort_keys, CLEANER_DELETE_CONCURRENCY):
+        raise YelpCleanerError(f"Failed to delete from {table.__name__}: {undeleted}")
+    print(
+        f"Deleted records from {table.__name__}. [{user_id=}, {count=}"
+        f", seconds={time.perf_counter() - started:.3f}, sort_keys={stale_sort_keys}]"
     )
-    table.delete_records(records_to_delete)
-    print(f"Deleted records from {table.__name__}: {records_to_delete}")
-    return records_to_delete
+    return stale_sort_keys
+
+
+def get_live_biz_ids(user_id) -> List[str]:
+    """Walks every review page fetched from Yelp, none from PageBucket."""
+    review_count = fetch_review_count(user_id)
+    return get_biz_ids(get_user_review_page_urls(user_id, review_count))
 
 
 def process_user(user_id):
-    biz_ids = get_biz_ids(user_id)
-    deleted_url_records = cleanup_table(user_id, biz_ids, url_table, "SortKey#ReviewStatusPage#")
-    deleted_yelp_records = cleanup_table(user_id, biz_ids, yelp_table, "Review#")
-    emit_emf_metric(len(deleted_url_records), len(deleted_yelp_records))
+    fresh_urls = url_table.get_recently_fetched_urls(user_id, CLEANER_PAGE_MAX_AGE)
+    review_count = fetch_review_count(user_id, fresh_urls)
+    review_page_urls = get_user_review_page_urls(user_id, review_count)
+    first_page_reviews = fetch_reviews(review_page_urls[0], fresh_urls) if review_page_urls else []
+
+    fingerprint = get_fingerprint(review_count, first_page_reviews)
+    if fingerprint == get_cleaner_fingerprint(user_id):
+        print(f"Reviews unchanged since the last run, skipping. [{user_id=}, {fingerprint=}]")
+        metrics.count("CleanerUsersSkipped")
+        return
+
+    biz_ids = [review.biz_id for review in first_page_reviews]
+    biz_ids += get_biz_ids(review_page_urls[1:], fresh_urls)
+    stale = [
+        (table, prefix, find_stale_sort_keys(user_id, biz_ids, table, prefix))
+        for table, prefix in CLEANUP_TABLES
+    ]
+    if fresh_urls and any(stale_sort_keys for _, _, stale_sort_keys in stale):
+        # Stored pages were each fetched at a different time, so a review can move from one page to
+        # the next in between and appear on neither. Only delete what the live pages confirm
+        live_biz_ids = set(get_live_biz_ids(user_id))
+        stale = [
+            (table, prefix, [key for key in keys if key[len(prefix) :] not in live_biz_ids])
+            for table, prefix, keys in stale
+        ]
+
+    deleted_url_records, deleted_yelp_records = [
+        delete_stale_sort_keys(user_id, stale_sort_keys, table)
+        for table, _, stale_sort_keys in stale
+    ]
+    if not CLEANER_DRY_RUN:
+        metrics.count("UrlTableRecordsDeleted", len(deleted_url_records))
+        metrics.count("YelpTableRecordsDeleted", len(deleted_yelp_records))
+        # Only once cleanup succeeded, so a failed run is retried in full next time
+        set_cleaner_fingerprint(user_id, fingerprint)
+
+
+def try_process_user(user_id):
+    print(f"Processing user_id: {user_id}")
+    try:
+        process_user(user_id)
+    except Exception as e:
+        print(f"Error occurred while processing user_id: {user_id}")
+        traceback.print_exc()
+        return e
 
 
+@metrics.emits_metrics("YelpCleaner")
 def handle(event, context=None):
     print(f"Triggered for event: {event}")
 
-    for user_id in get_all_user_ids():
-        print(f"Processing user_id: {user_id}")
-        process_user(user_id)
+    errors = [e for e in USER_EXECUTOR.map(try_process_user, get_all_user_ids()) if e]
+    if errors:
+        raise YelpCleanerError(
+            f"Encountered {len(errors)} total error(s) during processing. See execution log for errors."
+        )
 
     return {"statusCode": 200}
@@ -1,11 +1,17 @@
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import unquote_plus
 
+from yelp import metrics
+from yelp.config import PARSE_CONCURRENCY
 from yelp.parser.base_parser import BaseParser
 from yelp.parser.review_status_parser import ReviewStatusParser
 from yelp.parser.reviews_page_parser import ReviewsPageParser
 from yelp.parser.user_metadata_parser import UserMetadataParser
-from yelp.persistence.page_bucket import KeyUtils, download_page
+from yelp.persistence.page_bucket import USER_ID_METADATA, KeyUtils, open_page
+from yelp.persistence.yelp_table import batch_updates
+
+EXECUTOR = ThreadPoolExecutor(PARSE_CONCURRENCY)
 
 
 class YelpParserError(Exception):
@@ -16,6 +22,10 @@ class UnrecognizedUrlError(YelpParserError):
     pass
 
 
+class UnwrittenResultsError(YelpParserError):
+    pass
+
+
 def get_parser(url) -> BaseParser:
     if "user_details?userid" in url:
         return UserMetadataParser
@@ -35,21 +45,30 @@ def process_record(record):
     url = KeyUtils.from_key(key)
     if parser_cls := get_parser(url):
         print(f"Processing record. [{key=}, {url=}]")
-        page = download_page(url)
-        parser_cls().process(url, page)
+        metadata, page = open_page(url)
+        parser_cls(user_id=metadata.get(USER_ID_METADATA)).process(url, page)
 
 
+def try_process_record(record):
+    try:
+        process_record(record)
+    except Exception as e:
+        print(f"Error occurred while processing record: {record}")
+        metrics.count("ParseErrors")
+        traceback.print_exc()
+        return e
+
+
+@metrics.emits_metrics("YelpParser")
 def handle(event, context=None):
     print(f"Triggered for event: {event}")
 
-    errors = []
-    for record in event["Records"]:
-        try:
-            process_record(record)
-        except Exception as e:
-            print(f"Error occurred while processing record: {record}")
-            traceback.print_exc()
-            errors.append(e)
+    with batch_updates() as batch:
+        errors = [e for e in EXECUTOR.map(try_process_record, event["Records"]) if e]
+
+    if batch.failures:
+        print(f"Failed to write parsed results: {batch.failures}")
+        errors.append(UnwrittenResultsError(f"{len(batch.failures)} update(s)"))
 
     if errors:
         raise YelpParserError(
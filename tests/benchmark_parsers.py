@@ -0,0 +1,148 @@
+"""Replays the saved pages in tests/unit/resources through their parsers, offline.
+
+    python -m tests.benchmark_parsers [--number N] [--save PATH] [--compare PATH]
+
+Stages per page and backend:
+    to_soup  - the whole tree, i.e. tree-building cost alone
+    load     - what the parser builds (restricted tree, or the raw page)
+    extract  - parse() on an already loaded page
+    process  - load + extract
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+import tracemalloc
+
+from tests.util import get_file, get_test_dir
+from yelp.parser.base_parser import BaseParser
+from yelp.parser.review_status_parser import ReviewStatusParser
+from yelp.parser.reviews_page_parser import ReviewsPageParser
+from yelp.parser.user_metadata_parser import UserMetadataParser
+from yelp.parser.util import CHUNKED_TREE_BUILDERS, to_soup
+
+RESOURCES_DIR = "unit/resources"
+DEFAULT_NUMBER = 20
+DEFAULT_THRESHOLD = 1.2
+
+# Resource dir -> (parser, function of the resource filename to the page's url)
+PAGE_TYPES = {
+    "biz": (
+        ReviewStatusParser(),
+        lambda name: "https://www.yelp.com/biz/" + re.sub(r"_(alive|dead)\.html$", "", name),
+    ),
+    "user_details": (
+        UserMetadataParser(),
+        lambda name: "https://www.yelp.com/user_details?userid=" + name[: -len(".html")],
+    ),
+    "user_details_reviews_self": (
+        ReviewsPageParser(),
+        lambda name: "https://www.yelp.com/user_details_reviews_self?userid="
+        + name.split("_page_")[0],
+    ),
+}
+
+
+def get_cases():
+    """Yields (case name, parser, url, page) for every saved page."""
+    for page_type, (parser, to_url) in PAGE_TYPES.items():
+        for name in sorted(os.listdir(os.path.join(get_test_dir(), RESOURCES_DIR, page_type))):
+            resource = f"{RESOURCES_DIR}/{page_type}/{name}"
+            yield f"{page_type}/{name}", parser, to_url(name), get_file(resource)
+
+
+def load(parser, page, backend):
+    """`parser.load`, but on the given backend."""
+    if type(parser).load is BaseParser.load:
+        return to_soup(page, backend, parser.PARSE_ONLY)
+    return parser.load(page)
+
+
+def get_stages(parser, url, page, backend):
+    loaded = load(parser, page, backend)
+    return {
+        "to_soup": lambda: to_soup(page, backend),
+        "load": lambda: load(parser, page, backend),
+        "extract": lambda: parser.parse(url, loaded),
+        "process": lambda: parser.parse(url, load(parser, page, backend)),
+    }
+
+
+def measure(fn, number):
+    """Returns mean wall time, peak traced memory and the blocks left allocated by one call."""
+    fn()  # warm up
+    seconds = timeit.timeit(fn, number=number) / number
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = fn()  # noqa: F841 - kept alive so its blocks show up in the snapshot
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return {"ms": seconds * 1000, "peak_kib": peak / 1024, "blocks": blocks}
+
+
+def run(number):
+    results = {}
+    for backend in sorted(CHUNKED_TREE_BUILDERS):
+        for case, parser, url, page in get_cases():
+            for stage, fn in get_stages(parser, url, page, backend).items():
+                key = f"{backend}:{case}:{stage}"
+                results[key] = measure(fn, number)
+                print(format_row(key, results[key]))
+    return results
+
+
+def format_row(key, result, baseline=None):
+    row = f"{key:<100}" + "".join(f"{k}={v:10.2f} " for k, v in result.items())
+    if baseline:
+        row += " ".join(f"{k}x{v / baseline[k]:.2f}" for k, v in result.items() if baseline.get(k))
+    return row
+
+
+def compare(results, baseline, threshold):
+    """Prints every row against the baseline, returns the keys that regressed past `threshold`."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        print(format_row(key, result, baseline[key]))
+        if any(
+            baseline[key].get(metric) and result[metric] > baseline[key][metric] * threshold
+            for metric in ("ms", "peak_kib")
+        ):
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog="python -m tests.benchmark_parsers")
+    arg_parser.add_argument("--number", type=int, default=DEFAULT_NUMBER, help="Timed runs")
+    arg_parser.add_argument("--save", help="Write the results to this baseline file")
+    arg_parser.add_argument("--compare", help="Compare the results against this baseline file")
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = arg_parser.parse_args()
+
+    results = run(args.number)
+
+    if args.save:
+        with open(args.save, "w+") as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save}.")
+
+    if args.compare:
+        with open(args.compare, "r") as fp:
+            baseline = json.load(fp)
+        if regressions := compare(results, baseline, args.threshold):
+            print(f"Regressed more than {args.threshold}x: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
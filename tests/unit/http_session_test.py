@@ -0,0 +1,37 @@
+from unittest.mock import Mock, patch
+
+from yelp.http_session import create_session
+
+
+@patch("yelp.http_session.HTTPAdapter.send")
+def test_create_session_default_timeout(mock_send):
+    # Given
+    adapter = create_session(pool_size=4, timeout=(1, 2)).get_adapter("https://www.yelp.com")
+
+    # When
+    adapter.send(Mock())
+
+    # Then
+    assert mock_send.call_args.kwargs["timeout"] == (1, 2)
+
+
+@patch("yelp.http_session.HTTPAdapter.send")
+def test_create_session_explicit_timeout(mock_send):
+    # Given
+    adapter = create_session(pool_size=4, timeout=(1, 2)).get_adapter("https://www.yelp.com")
+
+    # When
+    adapter.send(Mock(), timeout=5)
+
+    # Then
+    assert mock_send.call_args.kwargs["timeout"] == 5
+
+
+def test_create_session_pool_size():
+    # When
+    session = create_session(pool_size=42)
+
+    # Then
+    adapter = session.get_adapter("https://www.yelp.com")
+    assert adapter._pool_maxsize == 42
+    assert adapter._pool_connections == 42
@@ -0,0 +1,129 @@
+import json
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from freezegun import freeze_time
+from yelp import metrics
+
+
+@pytest.fixture(autouse=True)
+def empty_buffer():
+    metrics.flush("test")
+    yield
+    metrics.flush("test")
+
+
+def get_documents(mock_print):
+    return [json.loads(c.args[0]) for c in mock_print.call_args_list]
+
+
+@freeze_time("2020-01-01")
+@patch("yelp.metrics.print")
+def test_flush(mock_print):
+    # Given
+    metrics.count("Deleted", 2)
+    metrics.count("Deleted")
+    metrics.record("Size", 10, metrics.BYTES)
+    metrics.record("Size", 20, metrics.BYTES)
+
+    # When
+    metrics.flush("TestFunction")
+
+    # Then
+    assert get_documents(mock_print) == [
+        {
+            "_aws": {
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": "YelpOrchestrator",
+                        "Dimensions": [["Function"]],
+                        "Metrics": [
+                            {"Name": "Deleted", "Unit": "Count"},
+                            {"Name": "Size", "Unit": "Bytes"},
+                        ],
+                    }
+                ],
+                "Timestamp": 1577836800000,
+            },
+            "Function": "TestFunction",
+            "Deleted": 3,
+            "Size": [10, 20],
+        }
+    ]
+
+
+@patch("yelp.metrics.print")
+def test_flush_empty(mock_print):
+    # When
+    metrics.flush("TestFunction")
+
+    # Then
+    mock_print.assert_not_called()
+
+
+@patch("yelp.metrics.print")
+def test_flush_over_max_values(mock_print):
+    # Given
+    metrics.count("Deleted")
+    for i in range(metrics.MAX_VALUES + 1):
+        metrics.record("Size", i)
+
+    # When
+    metrics.flush("TestFunction")
+
+    # Then
+    first, second = get_documents(mock_print)
+    assert first["Deleted"] == 1 and len(first["Size"]) == metrics.MAX_VALUES
+    assert "Deleted" not in second and second["Size"] == [metrics.MAX_VALUES]
+    assert second["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "Size", "Unit": "Count"}]
+
+
+@patch("yelp.metrics.print")
+def test_timer(mock_print):
+    # When
+    with metrics.timer("Latency"):
+        pass
+    metrics.flush("TestFunction")
+
+    # Then
+    (document,) = get_documents(mock_print)
+    assert len(document["Latency"]) == 1
+    assert document["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [
+        {"Name": "Latency", "Unit": "Milliseconds"}
+    ]
+
+
+@patch("yelp.metrics.flush")
+def test_emits_metrics(mock_flush):
+    # Given
+    @metrics.emits_metrics("TestFunction")
+    def handle(event, context=None):
+        raise Exception()
+
+    # When
+    with pytest.raises(Exception):
+        handle({})
+
+    # Then
+    mock_flush.assert_called_once_with("TestFunction")
+
+
+@patch("yelp.metrics.print")
+def test_instrument(mock_print):
+    # Given
+    client = metrics.instrument(boto3.client("dynamodb"))
+    with Stubber(client) as stubber:
+        stubber.add_response("get_item", {})
+        stubber.add_response("get_item", {})
+
+        # When
+        client.get_item(TableName="Table", Key={"Id": {"S": "1"}})
+        client.get_item(TableName="Table", Key={"Id": {"S": "2"}})
+    metrics.flush("TestFunction")
+
+    # Then
+    (document,) = get_documents(mock_print)
+    assert document["DynamoDBCalls"] == 2
+    assert len(document["DynamoDBLatency"]) == 2
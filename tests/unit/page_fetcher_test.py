@@ -1,9 +1,31 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from unittest.mock import Mock, call, patch
 
 from freezegun import freeze_time
 from tests.util import random_string
 from yelp import page_fetcher
-from yelp.page_fetcher import BatchProcessor, gather_batch
+from tests.util import get_file
+from yelp.page_fetcher import (
+    BatchProcessor,
+    FetchResultNotWrittenError,
+    gather_batch,
+    page_digest,
+)
+
+
+# The tests freeze time at 2020-08-23 UTC
+def get_flushed(mock_update_fetched_items):
+    """Every (item, status_code) written, across flushes, in URL order."""
+    flushed = [pair for c in mock_update_fetched_items.call_args_list for pair in c.args[0]]
+    return sorted(flushed, key=lambda pair: pair[0]["PageUrl"])
+
+
+LAST_UPLOADED = int(datetime(2020, 8, 23, tzinfo=timezone.utc).timestamp())
+CONTENT_DIGEST = hashlib.sha256(b"content").hexdigest()
 
 
 @patch("yelp.page_fetcher.get_all_url_items")
@@ -18,6 +40,7 @@ def test_gather_batch(mock_get_all_url_items):
         {"PageUrl": "5", "LastFetched": 5, "ErrorMessage": "Error!"},
     ]
     page_fetcher.FETCH_BATCH_SIZE = 3
+    page_fetcher.FETCH_USE_INDEX = False
 
     # When
     batch = gather_batch()
@@ -30,59 +53,91 @@ def test_gather_batch(mock_get_all_url_items):
     ]
 
 
+@patch("yelp.page_fetcher.get_all_url_items")
+@patch("yelp.page_fetcher.get_due_url_items")
+def test_gather_batch_from_index(mock_get_due_url_items, mock_get_all_url_items):
+    # Given
+    items = [{"PageUrl": "0", "LastFetched": 0}, {"PageUrl": "1", "LastFetched": 1}]
+    mock_get_due_url_items.return_value = items
+    page_fetcher.FETCH_BATCH_SIZE = 3
+    page_fetcher.FETCH_USE_INDEX = True
+
+    # When
+    batch = gather_batch()
+
+    # Then
+    assert batch == items
+    mock_get_due_url_items.assert_called_once_with(3)
+    mock_get_all_url_items.assert_not_called()
+
+
 @freeze_time("2020-08-23")
 @patch("yelp.page_fetcher.upload_page")
-@patch("yelp.page_fetcher.update_fetched_url")
-@patch("yelp.page_fetcher.requests")
-def test_batch_process_single_success(mock_requests, mock_update_fetched_url, mock_upload_page):
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_single_success(mock_session, mock_update_fetched_items, mock_upload_page):
     # Given
     url = "https://foo.com"
     mock_response = Mock()
     mock_response.status_code = 200
-    mock_response.content = "content"
+    mock_response.content = b"content"
+    mock_response.headers = {}
     mock_response.text = "text"
-    mock_requests.get.return_value = mock_response
+    mock_session.get.return_value = mock_response
 
     # When
     batch = BatchProcessor()
-    batch.process([{"PageUrl": url}])
+    batch.process([{"UserId": "test-user-id", "PageUrl": url}])
 
     # Then
-    mock_requests.get.assert_called_once_with(url)
-    mock_upload_page.assert_called_once_with(url, "content")
-    mock_update_fetched_url.assert_called_once_with(url, 200)
+    mock_session.get.assert_called_once_with(url, headers={})
+    mock_upload_page.assert_called_once_with(url, b"content", "test-user-id")
+    mock_update_fetched_items.assert_called_once_with(
+        [
+            (
+                {
+                    "UserId": "test-user-id",
+                    "PageUrl": url,
+                    "LastUploaded": LAST_UPLOADED,
+                    "ContentDigest": CONTENT_DIGEST,
+                },
+                200,
+            )
+        ]
+    )
     assert batch.errors == []
 
 
 @freeze_time("2020-08-23")
 @patch("yelp.page_fetcher.upload_page")
-@patch("yelp.page_fetcher.update_fetched_url")
-@patch("yelp.page_fetcher.requests")
-def test_batch_process_single_error(mock_requests, mock_update_fetched_url, mock_upload_page):
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_single_error(mock_session, mock_update_fetched_items, mock_upload_page):
     # Given
     url = "https://foo.com"
     mock_response = Mock()
     mock_response.status_code = 404
-    mock_response.content = "content"
+    mock_response.content = b"content"
+    mock_response.headers = {}
     mock_response.text = "text"
-    mock_requests.get.return_value = mock_response
+    mock_session.get.return_value = mock_response
 
     # When
     batch = BatchProcessor()
     batch.process([{"PageUrl": url}])
 
     # Then
-    mock_requests.get.assert_called_once_with(url)
+    mock_session.get.assert_called_once_with(url, headers={})
     mock_upload_page.assert_not_called()
-    mock_update_fetched_url.assert_called_once_with(url, 404)
+    mock_update_fetched_items.assert_called_once_with([({"PageUrl": url}, 404)])
     assert len(batch.errors) == 1
 
 
 @freeze_time("2020-08-23")
 @patch("yelp.page_fetcher.upload_page")
-@patch("yelp.page_fetcher.update_fetched_url")
-@patch("yelp.page_fetcher.requests")
-def test_batch_process_multiple_success(mock_requests, mock_update_fetched_url, mock_upload_page):
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_multiple_success(mock_session, mock_update_fetched_items, mock_upload_page):
     # Given
     count = 10
 
@@ -92,28 +147,32 @@ def test_batch_process_multiple_success(mock_requests, mock_update_fetched_url,
     for _ in range(count):
         mock_response = Mock()
         mock_response.status_code = 200
-        mock_response.content = "content"
+        mock_response.content = b"content"
+        mock_response.headers = {}
         mock_response.text = random_string()
         mock_responses.append(mock_response)
-    mock_requests.get.side_effect = mock_responses
+    mock_session.get.side_effect = mock_responses
 
     # When
     batch = BatchProcessor()
     batch.process([{"PageUrl": url} for url in urls])
 
     # Then
-    mock_requests.get.assert_has_calls([call(url) for url in urls], any_order=True)
-    mock_update_fetched_url.assert_has_calls([call(url, 200) for url in urls], any_order=True)
-    mock_upload_page.assert_has_calls([call(url, "content") for url in urls], any_order=True)
+    mock_session.get.assert_has_calls([call(url, headers={}) for url in urls], any_order=True)
+    assert get_flushed(mock_update_fetched_items) == [
+        ({"PageUrl": url, "LastUploaded": LAST_UPLOADED, "ContentDigest": CONTENT_DIGEST}, 200)
+        for url in sorted(urls)
+    ]
+    mock_upload_page.assert_has_calls([call(url, b"content", None) for url in urls], any_order=True)
     assert batch.errors == []
 
 
 @freeze_time("2020-08-23")
 @patch("yelp.page_fetcher.upload_page")
-@patch("yelp.page_fetcher.update_fetched_url")
-@patch("yelp.page_fetcher.requests")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
 def test_batch_process_multiple_success_single_error(
-    mock_requests, mock_update_fetched_url, mock_upload_page
+    mock_session, mock_update_fetched_items, mock_upload_page
 ):
     # Given
     count = 10
@@ -122,16 +181,15 @@ def test_batch_process_multiple_success_single_error(
     urls = [random_string() for _ in range(count)]
     failed_url = urls[failed_index]
 
-    mock_responses = []
-    for i in range(count):
+    def get(url, headers):
         mock_response = Mock()
-        mock_response.status_code = 200
-        if i == failed_index:
-            mock_response.status_code = 400
-        mock_response.content = "content"
+        mock_response.status_code = 400 if url == failed_url else 200
+        mock_response.content = b"content"
+        mock_response.headers = {}
         mock_response.text = random_string()
-        mock_responses.append(mock_response)
-    mock_requests.get.side_effect = mock_responses
+        return mock_response
+
+    mock_session.get.side_effect = get
 
     # When
     batch = BatchProcessor()
@@ -139,14 +197,221 @@ def test_batch_process_multiple_success_single_error(
 
     # Assert successful URLs processed
     success_urls = urls[:failed_index] + urls[failed_index + 1 :]
-    mock_requests.get.assert_has_calls([call(url) for url in success_urls], any_order=True)
-    mock_update_fetched_url.assert_has_calls(
-        [call(url, 200) for url in success_urls], any_order=True
+    mock_session.get.assert_has_calls(
+        [call(url, headers={}) for url in success_urls], any_order=True
     )
+    assert get_flushed(mock_update_fetched_items) == [
+        (
+            ({"PageUrl": url}, 400)
+            if url == failed_url
+            else (
+                {
+                    "PageUrl": url,
+                    "LastUploaded": LAST_UPLOADED,
+                    "ContentDigest": CONTENT_DIGEST,
+                },
+                200,
+            )
+        )
+        for url in sorted(urls)
+    ]
     mock_upload_page.assert_has_calls(
-        [call(url, "content") for url in success_urls], any_order=True
+        [call(url, b"content", None) for url in success_urls], any_order=True
     )
 
     # Assert failed URL processed
-    mock_update_fetched_url.assert_has_calls([call(failed_url, 400)])
     assert len(batch.errors) == 1
+
+
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_bounded_workers(mock_session, mock_update_fetched_items, mock_upload_page):
+    # Given
+    count, max_workers = 20, 2
+    urls = [random_string() for _ in range(count)]
+
+    in_flight, max_in_flight = [0], [0]
+    lock = Lock()
+
+    def get(url, headers):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        mock_response = Mock()
+        mock_response.status_code = 404 if url == urls[0] else 200
+        mock_response.content = b"content"
+        mock_response.headers = {}
+        return mock_response
+
+    mock_session.get.side_effect = get
+
+    # When
+    batch = BatchProcessor(executor=ThreadPoolExecutor(max_workers=max_workers))
+    batch.process([{"PageUrl": url} for url in urls])
+
+    # Then
+    assert max_in_flight[0] <= max_workers
+    assert [result.url for result in batch.results] == urls
+    assert [result.status_code for result in batch.results] == [404] + [200] * (count - 1)
+    assert len(batch.errors) == 1
+
+
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_unwritten_results(mock_session, mock_update_fetched_items, mock_upload_page):
+    # Given
+    urls = [random_string() for _ in range(3)]
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.content = b"content"
+    mock_response.headers = {}
+    mock_session.get.return_value = mock_response
+    mock_update_fetched_items.return_value = [{"PageUrl": urls[1], "StatusCode": 200}]
+
+    # When
+    batch = BatchProcessor()
+    batch.process([{"PageUrl": url} for url in urls])
+
+    # Then
+    assert len(batch.errors) == 1
+    assert isinstance(batch.results[1].error, FetchResultNotWrittenError)
+
+
+@freeze_time("2020-08-23")
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_not_modified(mock_session, mock_update_fetched_items, mock_upload_page):
+    # Given
+    url = "https://foo.com"
+    item = {
+        "PageUrl": url,
+        "ETag": "etag",
+        "LastModified": "date",
+        "LastUploaded": LAST_UPLOADED,
+        "ContentDigest": CONTENT_DIGEST,
+    }
+    mock_response = Mock()
+    mock_response.status_code = 304
+    mock_response.content = b""
+    mock_response.headers = {"ETag": "new-etag"}
+    mock_session.get.return_value = mock_response
+    page_fetcher.PAGE_REUPLOAD_AGE = 60
+
+    # When
+    batch = BatchProcessor()
+    batch.process([item])
+
+    # Then
+    mock_session.get.assert_called_once_with(
+        url, headers={"If-None-Match": "etag", "If-Modified-Since": "date"}
+    )
+    mock_upload_page.assert_not_called()
+    mock_update_fetched_items.assert_called_once_with([({**item, "ETag": "new-etag"}, 304)])
+    assert batch.errors == []
+
+
+@freeze_time("2020-08-23")
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_stores_validators(mock_session, mock_update_fetched_items, mock_upload_page):
+    # Given
+    url = "https://foo.com"
+    item = {"PageUrl": url, "ETag": "etag", "LastUploaded": LAST_UPLOADED - 60}
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.content = b"content"
+    mock_response.headers = {"Last-Modified": "date"}
+    mock_session.get.return_value = mock_response
+    page_fetcher.PAGE_REUPLOAD_AGE = 60
+
+    # When
+    batch = BatchProcessor()
+    batch.process([item])
+
+    # Then
+    mock_session.get.assert_called_once_with(url, headers={})  # Stale upload isn't revalidated
+    mock_upload_page.assert_called_once_with(url, b"content", None)
+    mock_update_fetched_items.assert_called_once_with(
+        [
+            (
+                {
+                    "PageUrl": url,
+                    "LastModified": "date",
+                    "LastUploaded": LAST_UPLOADED,
+                    "ContentDigest": CONTENT_DIGEST,
+                },
+                200,
+            )
+        ]
+    )
+
+
+@freeze_time("2020-08-23")
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items")
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_unchanged_content(mock_session, mock_update_fetched_items, mock_upload_page):
+    # Given
+    url = "https://foo.com"
+    item = {"PageUrl": url, "ContentDigest": CONTENT_DIGEST, "LastUploaded": LAST_UPLOADED}
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.content = b"content"
+    mock_response.headers = {}
+    mock_session.get.return_value = mock_response
+    page_fetcher.PAGE_REUPLOAD_AGE = 60
+
+    # When
+    batch = BatchProcessor()
+    batch.process([item])
+
+    # Then
+    mock_upload_page.assert_not_called()
+    mock_update_fetched_items.assert_called_once_with([(item, 200)])
+    assert batch.errors == []
+
+
+@patch("yelp.page_fetcher.upload_page")
+@patch("yelp.page_fetcher.update_fetched_items", return_value=[])
+@patch("yelp.page_fetcher.SESSION")
+def test_batch_process_flushes_incrementally(
+    mock_session, mock_update_fetched_items, mock_upload_page
+):
+    # Given
+    urls = [random_string() for _ in range(5)]
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.content = b"content"
+    mock_response.headers = {}
+    mock_session.get.return_value = mock_response
+
+    # When
+    batch = BatchProcessor(flush_size=2)
+    batch.process([{"PageUrl": url} for url in urls])
+
+    # Then
+    assert [len(c.args[0]) for c in mock_update_fetched_items.call_args_list] == [2, 2, 1]
+    assert [pair[0]["PageUrl"] for pair in get_flushed(mock_update_fetched_items)] == sorted(urls)
+    assert [result.url for result in batch.results] == urls
+
+
+def test_page_digest_ignores_volatile_markup():
+    # Given
+    page = get_file("unit/resources/user_details/5prk8CtPPBHNpa6BOja2ug.html").encode()
+    refetched_page = (
+        page.replace(b'nonce="815e6875"', b'nonce="0badf00d"')
+        .replace(b'csrf-token="428d15e6f998', b'csrf-token="0123456789ab')
+        .replace(b'class="csrftok"    value="70586b80', b'class="csrftok"    value="deadbeef')
+    )
+
+    # Then
+    assert refetched_page != page
+    assert page_digest(refetched_page) == page_digest(page)
+    assert page_digest(page.replace(b"Samuelze K.", b"Samuel K.")) != page_digest(page)
@@ -0,0 +1,45 @@
+import time
+from unittest.mock import patch
+
+from yelp.parser.base_parser import BaseParser
+from yelp.persistence.yelp_table import batch_updates
+
+
+class JoiningParser(BaseParser):
+    def load(self, page):
+        return "".join(page)
+
+    def parse(self, url, page):
+        return page
+
+    def write_result(self, url, result):
+        pass
+
+
+@patch("yelp.parser.base_parser.metrics")
+def test_process_excludes_page_reads(mock_metrics):
+    # Given
+    def slow_chunks():
+        for chunk in ("a", "b"):
+            time.sleep(0.1)  # E.g. waiting on S3
+            yield chunk
+
+    # When
+    JoiningParser().process("url", slow_chunks())
+
+    # Then
+    name, milliseconds, _ = mock_metrics.record.call_args.args
+    assert name == "JoiningParserTime"
+    assert 0 <= milliseconds < 100
+
+
+@patch("yelp.persistence.yelp_table.transact_update_items", return_value=[])
+def test_process_in_batch(_, capsys):
+    # When
+    with batch_updates():
+        JoiningParser().process("url", "page")
+
+    # Then
+    out = capsys.readouterr().out
+    assert "Buffered result for YelpTable." in out
+    assert "Wrote result to YelpTable." not in out
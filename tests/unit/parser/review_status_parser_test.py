@@ -1,20 +1,21 @@
 from unittest.mock import patch
 
+import pytest
+
 from tests.util import get_file
 from yelp.parser.review_status_parser import ParsedReviewStatus, ReviewStatusParser
-from yelp.parser.util import to_soup
 from yelp.persistence.yelp_table import ReviewId
 
 
 def test_parse():
     # Given
-    soup = to_soup(
-        get_file("unit/resources/biz/las-galas-los-angeles?hrid=q2pionpcY_-WZPwSWelTFw_dead.html")
+    page = get_file(
+        "unit/resources/biz/las-galas-los-angeles?hrid=q2pionpcY_-WZPwSWelTFw_dead.html"
     )
 
     # When
     result = ReviewStatusParser().parse(
-        "https://yelp.com/biz/las-galas-los-angeles?hrid=q2pionpcY_-WZPwSWelTFw", soup
+        "https://yelp.com/biz/las-galas-los-angeles?hrid=q2pionpcY_-WZPwSWelTFw", page
     )
 
     # Then
@@ -28,16 +29,14 @@ def test_parse():
 
 def test_parse_dead():
     # Given
-    soup = to_soup(
-        get_file(
-            "unit/resources/biz/thanh-son-tofu-garden-grove-3?hrid=OcEneH8BXu1z8-fpFFyrAg_alive.html"
-        )
+    page = get_file(
+        "unit/resources/biz/thanh-son-tofu-garden-grove-3?hrid=OcEneH8BXu1z8-fpFFyrAg_alive.html"
     )
 
     # When
     result = ReviewStatusParser().parse(
         "https://yelp.com/biz/thanh-son-tofu-garden-grove-3?hrid=OcEneH8BXu1z8-fpFFyrAg",
-        soup,
+        page,
     )
 
     # Then
@@ -49,6 +48,38 @@ def test_parse_dead():
     )
 
 
+@pytest.mark.parametrize(
+    "chunks,expected",
+    [
+        (["<p>", "abc-review-id", "</p>"], True),
+        (["<p>abc-rev", "iew-id</p>"], True),
+        (["<p>a", "b", "c-review-i", "d</p>"], True),
+        (["abc-review-i"], False),
+        (["abc-review-i", "x", "d"], False),
+        ([], False),
+    ],
+)
+def test_review_id_on_page_chunks(chunks, expected):
+    assert ReviewStatusParser.review_id_on_page(iter(chunks), "abc-review-id") == expected
+
+
+@patch("yelp.parser.base_parser.to_soup")
+@patch("yelp.parser.review_status_parser.update_review_status")
+@patch("yelp.parser.review_status_parser.get_user_id_from_review_id")
+def test_process_without_soup(_, mock_update_review_status, mock_to_soup):
+    # Given
+    chunks = iter(["<html>OcEneH8BX", "u1z8-fpFFyrAg</html>"])
+
+    # When
+    ReviewStatusParser().process(
+        "https://yelp.com/biz/thanh-son-tofu-garden-grove-3?hrid=OcEneH8BXu1z8-fpFFyrAg", chunks
+    )
+
+    # Then
+    mock_to_soup.assert_not_called()
+    assert mock_update_review_status.call_args.kwargs["status"] is True
+
+
 @patch("yelp.parser.review_status_parser.get_user_id_from_review_id")
 @patch("yelp.parser.review_status_parser.update_review_status")
 def test_write_result(mock_upsert_review, mock_get_user_id_from_review_id):
@@ -71,3 +102,20 @@ def test_write_result(mock_upsert_review, mock_get_user_id_from_review_id):
     mock_upsert_review.assert_called_once_with(
         user_id=user_id, review_id=review_id_tuple, status=is_alive
     )
+
+
+@patch("yelp.parser.review_status_parser.get_user_id_from_review_id")
+@patch("yelp.parser.review_status_parser.update_review_status")
+def test_write_result_known_user_id(mock_update_review_status, mock_get_user_id_from_review_id):
+    # Given
+    review_id_tuple = ReviewId(biz_id="test-biz-id", review_id="test-review-id")
+    result = ParsedReviewStatus(review_id_tuple=review_id_tuple, is_alive=True)
+
+    # When
+    ReviewStatusParser(user_id="test-user-id").write_result("", result)
+
+    # Then
+    mock_get_user_id_from_review_id.assert_not_called()
+    mock_update_review_status.assert_called_once_with(
+        user_id="test-user-id", review_id=review_id_tuple, status=True
+    )
@@ -80,6 +80,35 @@ def test_parse():
     ]
 
 
+def test_get_user_biz_reviews_skips_incomplete_review():
+    # Given
+    soup = to_soup("""
+        <div class="review" data-review-id="incomplete">
+            <span class="rating-qualifier">1/2/2020</span>
+        </div>
+        <div class="review" data-review-id="complete">
+            <a class="biz-name" href="/biz/some-biz">Some Biz</a>
+            <address>1 Main St<br/>Town, CA 90000</address>
+            <span class="rating-qualifier">1/1/2020 Updated review</span>
+            <span class="rating-qualifier">12/1/2019 Previous review</span>
+        </div>
+        """)
+
+    # When
+    result = ReviewsPageParser.get_user_biz_reviews(soup)
+
+    # Then
+    assert result == [
+        ParsedReviewMetadata(
+            biz_id="some-biz",
+            biz_name="Some Biz",
+            biz_address="1 Main St Town, CA 90000",
+            review_id="complete",
+            review_date="1/1/2020",
+        )
+    ]
+
+
 @patch("yelp.parser.reviews_page_parser.upsert_review")
 def test_write_result(mock_upsert_review):
     # Given
@@ -0,0 +1,99 @@
+import pytest
+from tests.util import get_file
+from yelp.parser.reviews_page_parser import ReviewsPageParser
+from yelp.parser.user_metadata_parser import UserMetadataParser
+from yelp.parser.util import (
+    CHUNKED_TREE_BUILDERS,
+    HTML_PARSER,
+    class_strainer,
+    get_backend,
+    to_soup,
+)
+
+BACKENDS = sorted(CHUNKED_TREE_BUILDERS)
+
+RESOURCES = (
+    "unit/resources/biz/las-galas-los-angeles?hrid=q2pionpcY_-WZPwSWelTFw_dead.html",
+    "unit/resources/user_details/5prk8CtPPBHNpa6BOja2ug.html",
+    "unit/resources/user_details_reviews_self/5prk8CtPPBHNpa6BOja2ug_page_last.html",
+)
+
+# (parser, url, resource) for every saved page a soup is built for
+PARSED_RESOURCES = (
+    (
+        UserMetadataParser,
+        "https://www.yelp.com/user_details?userid=5prk8CtPPBHNpa6BOja2ug",
+        "unit/resources/user_details/5prk8CtPPBHNpa6BOja2ug.html",
+    ),
+    *(
+        (
+            ReviewsPageParser,
+            "https://www.yelp.com/user_details_reviews_self?userid=5prk8CtPPBHNpa6BOja2ug",
+            f"unit/resources/user_details_reviews_self/5prk8CtPPBHNpa6BOja2ug_page_{page}.html",
+        )
+        for page in ("1", "15", "last")
+    ),
+)
+
+
+def chunked(page, chunk_size):
+    return (page[i : i + chunk_size] for i in range(0, len(page), chunk_size))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("resource", RESOURCES)
+@pytest.mark.parametrize("chunk_size", [1000, 64 * 1024])
+def test_to_soup_chunks(backend, resource, chunk_size):
+    # Given
+    page = get_file(resource)
+
+    # When
+    result = to_soup(chunked(page, chunk_size), backend)
+
+    # Then
+    assert str(result) == str(to_soup(page, backend))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("parser_cls,url,resource", PARSED_RESOURCES)
+def test_backend_parity(backend, parser_cls, url, resource):
+    # Given
+    page = get_file(resource)
+
+    # When
+    result = parser_cls().parse(url, to_soup(page, backend))
+
+    # Then
+    assert result == parser_cls().parse(url, to_soup(page, HTML_PARSER))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("parser_cls,url,resource", PARSED_RESOURCES)
+def test_parse_only_parity(backend, parser_cls, url, resource):
+    # Given
+    page = get_file(resource)
+    parser = parser_cls()
+
+    # When
+    result = parser.parse(url, to_soup(chunked(page, 64 * 1024), backend, parser.PARSE_ONLY))
+
+    # Then
+    assert result == parser.parse(url, to_soup(page, backend))
+
+
+def test_class_strainer():
+    # Given
+    page = '<div class="a b"><p>1</p></div><div class="ab"><p>2</p></div><p class="c">3</p>'
+
+    # When
+    result = to_soup(page, HTML_PARSER, class_strainer("b", "c"))
+
+    # Then
+    assert result.get_text() == "13"
+
+
+def test_get_backend(capsys):
+    assert get_backend(HTML_PARSER) == HTML_PARSER
+    assert "WARNING" not in capsys.readouterr().out
+    assert get_backend("not-installed") == HTML_PARSER
+    assert "WARNING" in capsys.readouterr().out
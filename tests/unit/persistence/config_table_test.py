@@ -1,8 +1,15 @@
 from datetime import datetime
 from unittest.mock import patch
 
+import pytest
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
-from yelp.persistence.config_table import get_all_user_ids, upsert_user_id
+from yelp.persistence.config_table import (
+    get_all_user_ids,
+    get_cleaner_fingerprint,
+    set_cleaner_fingerprint,
+    upsert_user_id,
+)
 
 
 @freeze_time("2020-08-23")
@@ -30,7 +37,46 @@ def test_get_all_user_ids(mock_table):
     )
 
     # When
-    result = get_all_user_ids()
+    result = list(get_all_user_ids(total_segments=1))
 
     # Then
     assert result == ["a", "b", "c", "d", "e"]
+    assert mock_table.scan.call_args.kwargs["ProjectionExpression"] == "#p0"
+
+
+@patch("yelp.persistence.config_table.CONFIG_TABLE")
+def test_get_cleaner_fingerprint(mock_table):
+    # Given
+    mock_table.get_item.side_effect = [{"Item": {"CleanerFingerprint": "12#review-id"}}, {}]
+
+    # When, Then
+    assert get_cleaner_fingerprint("test-user-id") == "12#review-id"
+    assert get_cleaner_fingerprint("test-user-id") is None
+
+
+@patch("yelp.persistence.config_table.CONFIG_TABLE")
+def test_set_cleaner_fingerprint_deleted_user(mock_table):
+    # Given
+    mock_table.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+    )
+
+    # When
+    set_cleaner_fingerprint("test-user-id", "12#review-id")
+
+    # Then
+    assert mock_table.update_item.call_args.kwargs["ConditionExpression"] == (
+        "attribute_exists(UserId)"
+    )
+
+
+@patch("yelp.persistence.config_table.CONFIG_TABLE")
+def test_set_cleaner_fingerprint_error(mock_table):
+    # Given
+    mock_table.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ThrottlingException"}}, "UpdateItem"
+    )
+
+    # When, Then
+    with pytest.raises(ClientError):
+        set_cleaner_fingerprint("test-user-id", "12#review-id")
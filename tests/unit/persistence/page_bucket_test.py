@@ -1,9 +1,17 @@
+import gzip
+import io
 import unittest
 from unittest.mock import Mock, patch
 
 from tests.util import random_string
 from yelp.persistence import page_bucket
-from yelp.persistence.page_bucket import KeyUtils, download_page, upload_page
+from yelp.persistence.page_bucket import (
+    KeyUtils,
+    download_page,
+    open_page,
+    stream_page,
+    upload_page,
+)
 
 
 class TestKeyUtils(unittest.TestCase):
@@ -47,7 +55,47 @@ def test_upload_page(mock_key_utils):
 
     # Then
     mock_s3.Object.assert_called_once_with(page_bucket_name, key)
-    mock_obj.put.assert_called_once_with(Body=html_bytes)
+    mock_obj.put.assert_called_once()
+    put_kwargs = mock_obj.put.call_args.kwargs
+    assert put_kwargs["ContentEncoding"] == "gzip"
+    assert put_kwargs["Metadata"] == {}
+    assert gzip.decompress(put_kwargs["Body"]) == html_bytes
+
+
+@patch("yelp.persistence.page_bucket.KeyUtils")
+def test_upload_page_user_id(mock_key_utils):
+    # Given
+    mock_s3, mock_obj = Mock(), Mock()
+    mock_s3.Object.return_value = mock_obj
+    page_bucket.S3 = mock_s3
+
+    # When
+    upload_page("test-url", b"html", "test-user-id")
+
+    # Then
+    assert mock_obj.put.call_args.kwargs["Metadata"] == {"user-id": "test-user-id"}
+
+
+@patch("yelp.persistence.page_bucket.KeyUtils")
+def test_open_page(mock_key_utils):
+    # Given
+    html = random_string(100)
+
+    mock_s3, mock_obj = Mock(), Mock()
+    mock_obj.get.return_value = {
+        "Body": io.BytesIO(gzip.compress(bytes(html, encoding="utf8"))),
+        "ContentEncoding": "gzip",
+        "Metadata": {"user-id": "test-user-id"},
+    }
+    mock_s3.Object.return_value = mock_obj
+    page_bucket.S3 = mock_s3
+
+    # When
+    metadata, chunks = open_page("test-url")
+
+    # Then
+    assert metadata == {"user-id": "test-user-id"}
+    assert "".join(chunks) == html
 
 
 @patch("yelp.persistence.page_bucket.KeyUtils")
@@ -62,7 +110,7 @@ def test_download_page(mock_key_utils):
     html_bytes = bytes(html, encoding="utf8")
 
     mock_s3, mock_obj, mock_streaming_body = Mock(), Mock(), Mock()
-    mock_streaming_body.read.return_value = html_bytes
+    mock_streaming_body.read.side_effect = [html_bytes, b""]
     mock_obj.get.return_value = {"Body": mock_streaming_body}
     mock_s3.Object.return_value = mock_obj
     page_bucket.S3 = mock_s3
@@ -76,3 +124,73 @@ def test_download_page(mock_key_utils):
     mock_s3.Object.assert_called_once_with(page_bucket_name, key)
     mock_obj.get.assert_called_once_with()
     assert result == html
+
+
+@patch("yelp.persistence.page_bucket.KeyUtils")
+def test_download_page_compressed(mock_key_utils):
+    # Given
+    page_bucket.PAGE_BUCKET_NAME = "test-bucket-name"
+    html = random_string(100)
+
+    mock_s3, mock_obj = Mock(), Mock()
+    mock_obj.get.return_value = {
+        "Body": io.BytesIO(gzip.compress(bytes(html, encoding="utf8"))),
+        "ContentEncoding": "gzip",
+    }
+    mock_s3.Object.return_value = mock_obj
+    page_bucket.S3 = mock_s3
+
+    mock_key_utils.to_key.return_value = "test-key"
+
+    # When
+    result = download_page("test-url")
+
+    # Then
+    assert result == html
+
+
+@patch("yelp.persistence.page_bucket.KeyUtils")
+def test_stream_page(mock_key_utils):
+    # Given
+    page_bucket.PAGE_BUCKET_NAME = "test-bucket-name"
+    html = "caf\u00e9 " * 10  # Multi-byte characters get split across chunks
+
+    mock_s3, mock_obj = Mock(), Mock()
+    mock_obj.get.return_value = {
+        "Body": io.BytesIO(gzip.compress(bytes(html, encoding="utf8"))),
+        "ContentEncoding": "gzip",
+    }
+    mock_s3.Object.return_value = mock_obj
+    page_bucket.S3 = mock_s3
+
+    mock_key_utils.to_key.return_value = "test-key"
+
+    # When
+    chunks = list(stream_page("test-url", chunk_size=4))
+
+    # Then
+    assert len(chunks) > 1
+    assert "".join(chunks) == html
+
+
+@patch("yelp.persistence.page_bucket.metrics")
+@patch("yelp.persistence.page_bucket.KeyUtils")
+def test_stream_page_stopped_early(mock_key_utils, mock_metrics):
+    # Given
+    page_bucket.PAGE_BUCKET_NAME = "test-bucket-name"
+    body = io.BytesIO(bytes(random_string(100), encoding="utf8"))
+
+    mock_s3, mock_obj = Mock(), Mock()
+    mock_obj.get.return_value = {"Body": body, "ContentLength": 100}
+    mock_s3.Object.return_value = mock_obj
+    page_bucket.S3 = mock_s3
+
+    # When
+    chunks = stream_page("test-url", chunk_size=10)
+    next(chunks)
+    chunks.close()
+
+    # Then
+    assert body.closed
+    mock_metrics.count.assert_called_once_with("S3BytesDownloaded", 10, mock_metrics.BYTES)
+    mock_metrics.record.assert_called_once()
@@ -1,10 +1,318 @@
 from datetime import datetime
+from unittest.mock import Mock, call, patch
 
+import pytest
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
-from yelp.persistence._util import calculate_ttl
+from yelp.persistence._util import (
+    batch_write_items,
+    calculate_ttl,
+    parallel_scan,
+    parallel_update_items,
+    query_items,
+    transact_update_items,
+    ttl_cache,
+)
 
 
 @freeze_time("2020-08-23")
 def test_calculate_ttl():
     ttl = 24
     assert calculate_ttl(ttl) == int(datetime(2020, 8, 23).timestamp()) + ttl
+
+
+def test_batch_write_items_chunks():
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    mock_table.meta.client.batch_write_item.return_value = {"UnprocessedItems": {}}
+    write_requests = [{"PutRequest": {"Item": {"Id": i}}} for i in range(60)]
+
+    # When
+    result = batch_write_items(mock_table, write_requests)
+
+    # Then
+    assert result == []
+    chunks = [
+        c.kwargs["RequestItems"]["test-table"]
+        for c in mock_table.meta.client.batch_write_item.call_args_list
+    ]
+    assert chunks == [write_requests[:25], write_requests[25:50], write_requests[50:]]
+
+
+def test_batch_write_items_parallel():
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    write_requests = [{"DeleteRequest": {"Key": {"Id": i}}} for i in range(60)]
+    mock_table.meta.client.batch_write_item.side_effect = lambda RequestItems: {
+        "UnprocessedItems": {"test-table": RequestItems["test-table"][:1]}
+    }
+
+    # When
+    result = batch_write_items(mock_table, write_requests, max_attempts=1, max_workers=3)
+
+    # Then
+    assert result == [write_requests[0], write_requests[25], write_requests[50]]
+    assert mock_table.meta.client.batch_write_item.call_count == 3
+
+
+@patch("yelp.persistence._util.time.sleep")
+def test_batch_write_items_retries_unprocessed(mock_sleep):
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    write_requests = [{"PutRequest": {"Item": {"Id": i}}} for i in range(3)]
+    mock_table.meta.client.batch_write_item.side_effect = [
+        {"UnprocessedItems": {"test-table": write_requests[1:]}},
+        {"UnprocessedItems": {"test-table": write_requests[2:]}},
+        {"UnprocessedItems": {}},
+    ]
+
+    # When
+    result = batch_write_items(mock_table, write_requests, base_delay=1)
+
+    # Then
+    assert result == []
+    assert mock_table.meta.client.batch_write_item.call_count == 3
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [1, 2]
+
+
+@patch("yelp.persistence._util.time.sleep")
+def test_batch_write_items_gives_up(_):
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    write_requests = [{"PutRequest": {"Item": {"Id": i}}} for i in range(3)]
+    mock_table.meta.client.batch_write_item.return_value = {
+        "UnprocessedItems": {"test-table": write_requests[2:]}
+    }
+
+    # When
+    result = batch_write_items(mock_table, write_requests, max_attempts=2)
+
+    # Then
+    assert result == write_requests[2:]
+    assert mock_table.meta.client.batch_write_item.call_count == 2
+
+
+def make_update(user_id, sort_key="Review#biz"):
+    return {
+        "Key": {"UserId": user_id, "SortKey": sort_key},
+        "UpdateExpression": "set Foo=:foo",
+        "ExpressionAttributeValues": {":foo": user_id},
+    }
+
+
+@patch("yelp.persistence._util.TRANSACT_WRITE_SIZE", 2)
+def test_transact_update_items_unique_keys_per_chunk():
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    update_1, update_2, update_3 = make_update("a"), make_update("a"), make_update("b")
+
+    # When
+    result = transact_update_items(mock_table, [update_1, update_2, update_3])
+
+    # Then
+    assert result == []
+    chunks = [
+        [item["Update"] for item in c.kwargs["TransactItems"]]
+        for c in mock_table.meta.client.transact_write_items.call_args_list
+    ]
+    assert chunks == [
+        [{"TableName": "test-table", **update_1}, {"TableName": "test-table", **update_3}],
+        [{"TableName": "test-table", **update_2}],
+    ]
+
+
+@patch("yelp.persistence._util.time.sleep")
+def test_transact_update_items_retries_per_item(_):
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    error = ClientError({"Error": {"Code": "TransactionCanceledException"}}, "TransactWriteItems")
+    mock_table.meta.client.transact_write_items.side_effect = error
+    update_1, update_2 = make_update("a"), make_update("b")
+    throttled = ClientError({"Error": {"Code": "ThrottlingException"}}, "UpdateItem")
+    mock_table.update_item.side_effect = [None, throttled, throttled, throttled]
+
+    # When
+    result = transact_update_items(mock_table, [update_1, update_2], max_attempts=3)
+
+    # Then
+    assert result == [update_2]
+    assert mock_table.update_item.call_count == 4
+
+
+@patch("yelp.persistence._util.time.monotonic")
+def test_ttl_cache(mock_monotonic):
+    # Given
+    mock_fn = Mock(side_effect=lambda x: x * 2)
+    cached = ttl_cache(maxsize=2, ttl=10)(mock_fn)
+    mock_monotonic.return_value = 0
+
+    # When, Then
+    assert [cached(1), cached(1), cached(2), cached(3), cached(1)] == [2, 2, 4, 6, 2]
+    assert mock_fn.call_count == 4  # 1 was evicted by 3
+
+    mock_monotonic.return_value = 10
+    assert cached(3) == 6
+    assert mock_fn.call_count == 5  # 3 expired
+
+
+def test_query_items_paginates():
+    # Given
+    mock_table = Mock()
+    mock_table.query.side_effect = [
+        {"Items": [1, 2], "LastEvaluatedKey": {"Id": 2}},
+        {"Items": [3]},
+    ]
+    key_condition = Mock()
+
+    # When
+    result = list(query_items(mock_table, key_condition, ["Id", "Name"]))
+
+    # Then
+    assert result == [1, 2, 3]
+    projection = {
+        "ProjectionExpression": "#p0, #p1",
+        "ExpressionAttributeNames": {"#p0": "Id", "#p1": "Name"},
+    }
+    assert mock_table.query.call_args_list == [
+        call(KeyConditionExpression=key_condition, **projection),
+        call(KeyConditionExpression=key_condition, **projection, ExclusiveStartKey={"Id": 2}),
+    ]
+
+
+def scan_segment_pages(**kwargs):
+    """Two pages per segment, with items tagged by segment and page."""
+    segment, page = kwargs["Segment"], kwargs.get("ExclusiveStartKey", 0)
+    response = {"Items": [f"{segment}-{page}"]}
+    if page == 0:
+        response["LastEvaluatedKey"] = 1
+    return response
+
+
+def test_parallel_scan():
+    # Given
+    mock_table = Mock()
+    mock_table.scan.side_effect = scan_segment_pages
+
+    # When
+    result = list(parallel_scan(mock_table, total_segments=3, projection=["Id"]))
+
+    # Then
+    assert sorted(result) == ["0-0", "0-1", "1-0", "1-1", "2-0", "2-1"]
+    assert mock_table.scan.call_count == 6
+    assert all(
+        c.kwargs["TotalSegments"] == 3 and c.kwargs["ProjectionExpression"] == "#p0"
+        for c in mock_table.scan.call_args_list
+    )
+
+
+def test_parallel_scan_error():
+    # Given
+    def scan(**kwargs):
+        if kwargs["Segment"] == 1:
+            raise ValueError("scan failed")
+        return {"Items": ["foo"]}
+
+    mock_table = Mock()
+    mock_table.scan.side_effect = scan
+
+    # When, Then
+    with pytest.raises(ValueError):
+        list(parallel_scan(mock_table, total_segments=2))
+
+
+def test_parallel_scan_closed_early():
+    # Given
+    mock_table = Mock()
+    mock_table.scan.side_effect = lambda **kwargs: {"Items": ["foo"], "LastEvaluatedKey": 1}
+
+    # When
+    items = parallel_scan(mock_table, total_segments=2)
+    first = next(items)
+    items.close()
+
+    # Then
+    assert first == "foo"
+
+
+@patch("yelp.persistence._util.time.sleep")
+def test_parallel_update_items(_):
+    # Given
+    def update_item(**update):
+        if update["Key"]["UserId"] == "b":
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "UpdateItem")
+
+    mock_table = Mock()
+    mock_table.update_item.side_effect = update_item
+    updates = [make_update("a"), make_update("b"), make_update("c")]
+
+    # When
+    result = parallel_update_items(mock_table, updates, max_workers=2, max_attempts=2)
+
+    # Then
+    assert result == [updates[1]]
+    assert mock_table.update_item.call_count == 4
+
+
+def test_parallel_update_items_ignored_error_codes():
+    # Given
+    mock_table = Mock()
+    mock_table.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+    )
+    updates = [make_update("a")]
+
+    # When
+    result = parallel_update_items(
+        mock_table, updates, max_workers=1, ignored_error_codes=("ConditionalCheckFailedException",)
+    )
+
+    # Then
+    assert result == []
+    assert mock_table.update_item.call_count == 1
+
+
+@patch("yelp.persistence._util.time.sleep")
+def test_parallel_update_items_fails_fast(mock_sleep):
+    # Given
+    mock_table = Mock()
+    mock_table.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ValidationException"}}, "UpdateItem"
+    )
+    updates = [make_update("a")]
+
+    # When
+    result = parallel_update_items(mock_table, updates, max_workers=1)
+
+    # Then
+    assert result == updates
+    assert mock_table.update_item.call_count == 1
+    mock_sleep.assert_not_called()
+
+
+def test_transact_update_items_ignored_error_codes():
+    # Given
+    mock_table = Mock()
+    mock_table.name = "test-table"
+    mock_table.meta.client.transact_write_items.side_effect = ClientError(
+        {"Error": {"Code": "TransactionCanceledException"}}, "TransactWriteItems"
+    )
+    mock_table.update_item.side_effect = [
+        None,
+        ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"),
+    ]
+    updates = [make_update("a"), make_update("b")]
+
+    # When
+    result = transact_update_items(
+        mock_table, updates, ignored_error_codes=("ConditionalCheckFailedException",)
+    )
+
+    # Then
+    assert result == []
+    assert mock_table.update_item.call_count == 2
@@ -1,10 +1,20 @@
 from datetime import datetime
+from decimal import Decimal
 from unittest.mock import patch
 
 import pytest
 from freezegun import freeze_time
 from tests.util import random_string
-from yelp.persistence.url_table import get_all_url_items, update_fetched_url, upsert_new_url
+from boto3.dynamodb.conditions import Key
+from yelp.persistence.url_table import (
+    get_all_url_items,
+    get_due_url_items,
+    get_recently_fetched_urls,
+    get_url_ttls,
+    update_fetched_items,
+    upsert_new_url,
+    upsert_new_urls,
+)
 
 
 @patch("yelp.persistence.url_table.URL_TABLE")
@@ -17,12 +27,92 @@ def test_get_all_items(mock_table):
     )
 
     # When
-    result = get_all_url_items()
+    result = list(get_all_url_items(total_segments=1))
 
     # Then
     assert result == ["a", "b", "c", "d", "e"]
 
 
+@freeze_time("2020-08-23")
+@patch("yelp.persistence.url_table.URL_TABLE")
+def test_get_recently_fetched_urls(mock_table):
+    # Given
+    now = int(datetime(2020, 8, 23).timestamp())
+    mock_table.query.return_value = {
+        "Items": [
+            {"PageUrl": "ok", "LastFetched": Decimal(now - 10), "StatusCode": Decimal(200)},
+            {"PageUrl": "not-modified", "LastFetched": Decimal(now), "StatusCode": Decimal(304)},
+            {"PageUrl": "old", "LastFetched": Decimal(now - 100), "StatusCode": Decimal(200)},
+            {"PageUrl": "error", "LastFetched": Decimal(now), "StatusCode": Decimal(500)},
+            {"PageUrl": "never-fetched"},
+        ]
+    }
+
+    # When
+    result = get_recently_fetched_urls("test-user-id", 60)
+
+    # Then
+    assert result == {"ok", "not-modified"}
+
+
+@patch("yelp.persistence.url_table.URL_TABLE")
+def test_get_url_ttls(mock_table):
+    # Given
+    mock_table.query.return_value = {
+        "Items": [
+            {"PageUrl": "a", "TimeToLive": Decimal(1), "FetchBucket": "Fetch"},
+            {"PageUrl": "b", "FetchBucket": "Fetch"},
+            {"PageUrl": "c", "TimeToLive": Decimal(1)},  # Not in the FetchBucket GSI yet
+        ]
+    }
+
+    # When
+    result = get_url_ttls("test-user-id")
+
+    # Then
+    assert result == {"a": 1, "b": 0, "c": 0}
+    assert mock_table.query.call_args.kwargs["ExpressionAttributeNames"] == {
+        "#p0": "PageUrl",
+        "#p1": "TimeToLive",
+        "#p2": "FetchBucket",
+    }
+
+
+@patch("yelp.persistence.url_table.URL_TABLE")
+def test_get_due_url_items(mock_table):
+    # Given
+    mock_table.query.side_effect = (
+        {"Items": ["a", "b"], "LastEvaluatedKey": "key-1"},
+        {"Items": ["c"], "LastEvaluatedKey": "key-2"},
+    )
+
+    # When
+    result = get_due_url_items(3)
+
+    # Then
+    assert result == ["a", "b", "c"]
+    assert mock_table.query.call_count == 2
+    first_call, second_call = mock_table.query.call_args_list
+    assert first_call.kwargs["IndexName"] == "FetchBucket"
+    assert first_call.kwargs["KeyConditionExpression"] == Key("FetchBucket").eq("Fetch")
+    assert first_call.kwargs["Limit"] == 3
+    assert second_call.kwargs["Limit"] == 1
+    assert second_call.kwargs["ExclusiveStartKey"] == "key-1"
+
+
+@patch("yelp.persistence.url_table.URL_TABLE")
+def test_get_due_url_items_exhausted(mock_table):
+    # Given
+    mock_table.query.return_value = {"Items": ["a"]}
+
+    # When
+    result = get_due_url_items(3)
+
+    # Then
+    assert result == ["a"]
+    mock_table.query.assert_called_once()
+
+
 @pytest.mark.parametrize(
     "url,expected_sort_key",
     [
@@ -59,57 +149,88 @@ def test_upsert_new_url(mock_table, url, expected_sort_key):
     # Then
     mock_table.update_item.assert_called_once_with(
         Key={"UserId": user_id, "SortKey": expected_sort_key},
-        UpdateExpression="set PageUrl=:url, TimeToLive=:ttl",
+        UpdateExpression=(
+            "set PageUrl=:url, TimeToLive=:ttl, FetchBucket=:fetch_bucket"
+            ", LastFetched=if_not_exists(LastFetched, :never)"
+        ),
         ExpressionAttributeValues={
             ":url": url,
             ":ttl": int(datetime(2020, 8, 23).timestamp()) + ttl,
+            ":fetch_bucket": "Fetch",
+            ":never": 0,
         },
     )
 
 
-@pytest.mark.parametrize(
-    "url,expected_sort_key",
-    [
-        ("https://www.yelp.com/user_details?userid=random-user-id", "SortKey#Metadata"),
-        (
-            "https://www.yelp.com/user_details?userid=random-user-id&ignored=ignored",
-            "SortKey#Metadata",
-        ),
-        (
-            "https://www.yelp.com/user_details_reviews_self?userid=random-user-id&rec_pagestart=42",
-            "SortKey#UserReviewPage#42",
-        ),
-        (
-            "https://www.yelp.com/user_details_reviews_self?userid=random-user-id&rec_pagestart=42&ignored=ignored",
-            "SortKey#UserReviewPage#42",
-        ),
-        ("https://www.yelp.com/biz/random-biz-name", "SortKey#ReviewStatusPage#random-biz-name"),
-        (
-            "https://www.yelp.com/biz/random-biz-name?ignored=ignored",
-            "SortKey#ReviewStatusPage#random-biz-name",
-        ),
-    ],
-)
 @freeze_time("2020-08-23")
-@patch("yelp.persistence.url_table.get_user_id_from_url")
-@patch("yelp.persistence.url_table.URL_TABLE")
-def test_update_fetched_url(mock_table, mock_get_user_id_from_url, url, expected_sort_key):
+@patch("yelp.persistence.url_table.transact_update_items")
+def test_update_fetched_items(mock_transact_update_items):
     # Given
-    status_code = 42
-
-    user_id = random_string()
-    mock_get_user_id_from_url.return_value = user_id
+    item_1 = {"UserId": "a", "SortKey": "SortKey#Metadata", "PageUrl": "url-1", "TimeToLive": 1}
+    item_2 = {
+        "UserId": "b",
+        "SortKey": "SortKey#Metadata",
+        "PageUrl": "url-2",
+        "ETag": "etag",
+        "LastModified": "last-modified",
+        "ContentDigest": "digest",
+        "LastUploaded": 42,
+    }
+    mock_transact_update_items.side_effect = lambda *args, **kwargs: args[1][1:]
 
     # When
-    update_fetched_url(url, status_code)
+    result = update_fetched_items([(item_1, 200), (item_2, 404)])
 
     # Then
-    mock_get_user_id_from_url.assert_called_once_with(url)
-    mock_table.update_item.assert_called_once_with(
-        Key={"UserId": user_id, "SortKey": expected_sort_key},
-        UpdateExpression="set StatusCode=:status_code, LastFetched=:last_fetched",
-        ExpressionAttributeValues={
-            ":status_code": status_code,
-            ":last_fetched": int(datetime(2020, 8, 23).timestamp()),
+    last_fetched = int(datetime(2020, 8, 23).timestamp())
+    _, updates = mock_transact_update_items.call_args.args
+    assert updates == [
+        {
+            "Key": {"UserId": "a", "SortKey": "SortKey#Metadata"},
+            "UpdateExpression": "set StatusCode=:status_code, LastFetched=:last_fetched"
+            " remove ETag, LastModified, ContentDigest, LastUploaded",
+            "ConditionExpression": "attribute_exists(UserId)",
+            "ExpressionAttributeValues": {":status_code": 200, ":last_fetched": last_fetched},
         },
-    )
+        {
+            "Key": {"UserId": "b", "SortKey": "SortKey#Metadata"},
+            "UpdateExpression": "set StatusCode=:status_code, LastFetched=:last_fetched"
+            ", ETag=:ETag, LastModified=:LastModified, ContentDigest=:ContentDigest"
+            ", LastUploaded=:LastUploaded",
+            "ConditionExpression": "attribute_exists(UserId)",
+            "ExpressionAttributeValues": {
+                ":status_code": 404,
+                ":last_fetched": last_fetched,
+                ":ETag": "etag",
+                ":LastModified": "last-modified",
+                ":ContentDigest": "digest",
+                ":LastUploaded": 42,
+            },
+        },
+    ]
+    assert mock_transact_update_items.call_args.kwargs == {
+        "ignored_error_codes": ("ConditionalCheckFailedException",)
+    }
+    assert result == [item_2]
+
+
+@patch("yelp.persistence.url_table.parallel_update_items")
+def test_upsert_new_urls(mock_parallel_update_items):
+    # Given
+    user_id = "test-user-id"
+    urls = [
+        "https://www.yelp.com/user_details?userid=test-user-id",
+        "https://www.yelp.com/biz/test-biz-id?hrid=test-review-id",
+    ]
+    mock_parallel_update_items.side_effect = lambda table, updates, max_workers: updates[1:]
+
+    # When
+    result = upsert_new_urls(user_id, urls)
+
+    # Then
+    assert result == urls[1:]
+    updates = mock_parallel_update_items.call_args.args[1]
+    assert [update["Key"] for update in updates] == [
+        {"UserId": user_id, "SortKey": "SortKey#Metadata"},
+        {"UserId": user_id, "SortKey": "SortKey#ReviewStatusPage#test-biz-id"},
+    ]
@@ -3,6 +3,7 @@ from unittest.mock import Mock, patch
 
 import pytest
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 from freezegun import freeze_time
 from tests.util import random_string
 from yelp.persistence import yelp_table
@@ -13,8 +14,11 @@ from yelp.persistence.yelp_table import (
     ReviewMetadata,
     UserMetadata,
     _upsert_record,
+    batch_updates,
+    delete_sort_keys,
     get_all_records,
     get_user_id_from_review_id,
+    iter_records,
     update_review_status,
     upsert_metadata,
     upsert_review,
@@ -46,6 +50,48 @@ def test_upsert_record():
     )
 
 
+def test_upsert_record_condition_failed():
+    # Given
+    mock_yelp_table = Mock()
+    mock_yelp_table.update_item.side_effect = ClientError(
+        {"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem"
+    )
+    yelp_table.YELP_TABLE = mock_yelp_table
+
+    # When
+    _upsert_record("user-1", "Review#biz", "set Foo=:foo", {":foo": "foo"}, "attribute_exists(Id)")
+
+    # Then
+    assert mock_yelp_table.update_item.call_args.kwargs["ConditionExpression"] == (
+        "attribute_exists(Id)"
+    )
+
+
+@patch("yelp.persistence.yelp_table.transact_update_items")
+def test_batch_updates(mock_transact_update_items):
+    # Given
+    mock_yelp_table = Mock()
+    yelp_table.YELP_TABLE = mock_yelp_table
+    mock_transact_update_items.return_value = ["failed"]
+
+    # When
+    with batch_updates() as batch:
+        _upsert_record("user-1", "Metadata", "set Foo=:foo", {":foo": "foo"})
+        _upsert_record("user-2", "Metadata", "set Foo=:foo", {":foo": "foo"})
+
+    # Then
+    mock_yelp_table.update_item.assert_not_called()
+    mock_transact_update_items.assert_called_once()
+    table, updates = mock_transact_update_items.call_args.args
+    assert table == mock_yelp_table
+    assert [update["Key"]["UserId"] for update in updates] == ["user-1", "user-2"]
+    assert mock_transact_update_items.call_args.kwargs == {
+        "ignored_error_codes": ("ConditionalCheckFailedException",)
+    }
+    assert batch.failures == ["failed"]
+    assert yelp_table._BATCH is None
+
+
 def test_get_all_records():
     # Given
     user_id = "test-user-id"
@@ -63,6 +109,26 @@ def test_get_all_records():
     mock_yelp_table.query.assert_called_once_with(KeyConditionExpression=Key("UserId").eq(user_id))
 
 
+def test_iter_records_sort_key_prefix():
+    # Given
+    user_id = "test-user-id"
+
+    mock_yelp_table = Mock()
+    mock_yelp_table.query.return_value = {"Items": ["foo"]}
+    yelp_table.YELP_TABLE = mock_yelp_table
+
+    # When
+    result = list(iter_records(user_id, "Review#", ["SortKey"]))
+
+    # Then
+    assert result == ["foo"]
+    mock_yelp_table.query.assert_called_once_with(
+        KeyConditionExpression=Key("UserId").eq(user_id) & Key("SortKey").begins_with("Review#"),
+        ProjectionExpression="#p0",
+        ExpressionAttributeNames={"#p0": "SortKey"},
+    )
+
+
 @patch("yelp.persistence.yelp_table.calculate_ttl")
 @patch("yelp.persistence.yelp_table._upsert_record")
 def test_upsert_metadata(mock_upsert_record, mock_calculate_ttl):
@@ -137,6 +203,7 @@ def test_update_review_status(mock_upsert_record):
         "Review#test-biz-id",
         "set ReviewStatus=:status",
         {":status": status},
+        "attribute_exists(ReviewId)",
     )
 
 
@@ -184,3 +251,38 @@ def test_get_user_id_from_review_id_multiple():
     # Then
     assert review_id in str(e.value)
     assert str(items) in str(e.value)
+
+
+def test_get_user_id_from_review_id_cached():
+    # Given
+    user_id, review_id = random_string(), random_string()
+
+    mock_yelp_table = Mock()
+    mock_yelp_table.query.return_value = {"Items": [{"UserId": user_id}]}
+    yelp_table.YELP_TABLE = mock_yelp_table
+
+    # When
+    results = [get_user_id_from_review_id(review_id) for _ in range(3)]
+
+    # Then
+    assert results == [user_id] * 3
+    mock_yelp_table.query.assert_called_once()
+
+
+@patch("yelp.persistence.yelp_table.batch_write_items")
+def test_delete_sort_keys(mock_batch_write_items):
+    # Given
+    mock_batch_write_items.return_value = [
+        {"DeleteRequest": {"Key": {"UserId": "test-user-id", "SortKey": "Review#b"}}}
+    ]
+
+    # When
+    result = delete_sort_keys("test-user-id", ["Review#a", "Review#b"], max_workers=2)
+
+    # Then
+    assert result == ["Review#b"]
+    assert mock_batch_write_items.call_args.args[1] == [
+        {"DeleteRequest": {"Key": {"UserId": "test-user-id", "SortKey": "Review#a"}}},
+        {"DeleteRequest": {"Key": {"UserId": "test-user-id", "SortKey": "Review#b"}}},
+    ]
+    assert mock_batch_write_items.call_args.kwargs == {"max_workers": 2}
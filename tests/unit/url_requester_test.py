@@ -1,13 +1,19 @@
+from datetime import datetime
 from decimal import Decimal
 from unittest.mock import call, patch
 
+import pytest
+from freezegun import freeze_time
 from tests.util import random_string
 from yelp.url_requester import (
     _create_review_status_url,
     _create_user_metadata_url,
     _create_user_review_pages_urls,
+    UrlUpsertError,
     _parse_ddb_record,
+    derive_urls,
     handle,
+    handle_yelp_table_record,
 )
 
 
@@ -25,35 +31,41 @@ def test_create_user_metadata_url(mock_upsert_new_url):
     )
 
 
-@patch("yelp.url_requester.upsert_new_url")
-def test_create_user_review_pages_urls(mock_upsert_new_url):
+@patch("yelp.url_requester.upsert_new_urls")
+def test_create_user_review_pages_urls(mock_upsert_new_urls):
     # Given
     user_id = random_string()
     review_count = Decimal(32)
     user_metadata_record = {"UserId": user_id, "ReviewCount": review_count}
+    mock_upsert_new_urls.return_value = []
 
     # When
     _create_user_review_pages_urls(user_metadata_record)
 
     # Then
-    mock_upsert_new_url.assert_has_calls(
+    mock_upsert_new_urls.assert_called_once_with(
+        user_id,
         [
-            call(
-                user_id,
-                f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=0",
-            ),
-            call(
-                user_id,
-                f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=10",
-            ),
-            call(
-                user_id,
-                f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=20",
-            ),
-        ]
+            f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=0",
+            f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=10",
+            f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=20",
+            f"https://www.yelp.com/user_details_reviews_self?userid={user_id}&rec_pagestart=30",
+        ],
     )
 
 
+@patch("yelp.url_requester.upsert_new_urls")
+def test_create_user_review_pages_urls_failed(mock_upsert_new_urls):
+    # Given
+    user_metadata_record = {"UserId": random_string(), "ReviewCount": Decimal(32)}
+    mock_upsert_new_urls.return_value = ["failed-url"]
+
+    # When, Then
+    with pytest.raises(UrlUpsertError) as error:
+        _create_user_review_pages_urls(user_metadata_record)
+    assert "failed-url" in str(error.value)
+
+
 @patch("yelp.url_requester.get_user_id_from_review_id")
 @patch("yelp.url_requester.upsert_new_url")
 def test_create_review_status_url(mock_upsert_new_url, mock_get_user_id_from_review_id):
@@ -73,6 +85,25 @@ def test_create_review_status_url(mock_upsert_new_url, mock_get_user_id_from_rev
     )
 
 
+@patch("yelp.url_requester.get_user_id_from_review_id")
+@patch("yelp.url_requester.upsert_new_url")
+def test_create_review_status_url_record_user_id(
+    mock_upsert_new_url, mock_get_user_id_from_review_id
+):
+    # Given
+    user_id, biz_id, review_id = random_string(), random_string(), random_string()
+    review_record = {"UserId": user_id, "BizId": biz_id, "ReviewId": review_id}
+
+    # When
+    _create_review_status_url(review_record)
+
+    # Then
+    mock_get_user_id_from_review_id.assert_not_called()
+    mock_upsert_new_url.assert_called_once_with(
+        user_id, f"https://www.yelp.com/biz/{biz_id}?hrid={review_id}"
+    )
+
+
 def test_parse_ddb_record():
     # Given
     event_record = {
@@ -106,43 +137,83 @@ def test_parse_ddb_record():
     }
 
 
-@patch("yelp.url_requester._create_review_status_url")
-@patch("yelp.url_requester._create_user_review_pages_urls")
-@patch("yelp.url_requester._create_user_metadata_url")
-@patch("yelp.url_requester.get_all_records")
+USER_ID = "test-user-id"
+METADATA_URL = f"https://www.yelp.com/user_details?userid={USER_ID}"
+PAGE_URL = f"https://www.yelp.com/user_details_reviews_self?userid={USER_ID}&rec_pagestart={{}}"
+REVIEW_STATUS_URL = "https://www.yelp.com/biz/test-biz-id?hrid=test-review-id"
+USER_RECORDS = [
+    {"UserId": USER_ID, "SortKey": "Metadata", "ReviewCount": Decimal(12)},
+    {
+        "UserId": USER_ID,
+        "SortKey": "Review#test-biz-id",
+        "BizId": "test-biz-id",
+        "ReviewId": "test-review-id",
+    },
+]
+
+
+def test_derive_urls():
+    assert derive_urls(USER_ID, USER_RECORDS) == [
+        METADATA_URL,
+        PAGE_URL.format(0),
+        PAGE_URL.format(10),
+        REVIEW_STATUS_URL,
+    ]
+
+
+@freeze_time("2020-08-23")
+@patch("yelp.url_requester.URL_TTL_REFRESH_WINDOW", 100)
+@patch("yelp.url_requester.upsert_new_urls", return_value=[])
+@patch("yelp.url_requester.get_url_ttls")
+@patch("yelp.url_requester.iter_records")
 @patch("yelp.url_requester.get_all_user_ids")
 def test_handle_cron_event(
-    mock_get_all_user_ids,
-    mock_get_all_records,
-    mock_create_user_metadata_url,
-    mock_create_user_review_pages_urls,
-    mock_create_review_status_url,
+    mock_get_all_user_ids, mock_iter_records, mock_get_url_ttls, mock_upsert_new_urls
 ):
     # Given
     event = {"source": "aws.events"}
-
-    user_id_1, user_id_2, user_id_3 = random_string(), random_string(), random_string()
-    mock_get_all_user_ids.return_value = [user_id_1, user_id_2, user_id_3]
-
-    record_1 = {"UserId": user_id_1, "SortKey": "Metadata"}
-    record_2 = {"UserId": user_id_1, "SortKey": "Review"}
-    record_3 = {"UserId": user_id_2, "SortKey": "Review"}
-    record_4 = {"UserId": user_id_3, "SortKey": "Metadata"}
-    mock_get_all_records.side_effect = [
-        [record_1, record_2],
-        [record_3],
-        [record_4],
-    ]
+    now = int(datetime(2020, 8, 23).timestamp())
+
+    mock_get_all_user_ids.return_value = [USER_ID]
+    mock_iter_records.return_value = USER_RECORDS
+    mock_get_url_ttls.return_value = {
+        METADATA_URL: now + 1000,
+        PAGE_URL.format(0): now + 10,
+        REVIEW_STATUS_URL: now + 1000,
+    }
 
     # When
     handle(event)
 
     # Then
-    mock_create_user_metadata_url.assert_has_calls(
-        [call(user_id_1), call(user_id_2), call(user_id_3)]
+    mock_get_url_ttls.assert_called_once_with(USER_ID)
+    mock_upsert_new_urls.assert_called_once_with(
+        USER_ID,
+        [
+            PAGE_URL.format(0),  # Expires within the refresh window
+            PAGE_URL.format(10),  # Not tracked yet
+        ],
     )
-    mock_create_user_review_pages_urls.assert_has_calls([call(record_1), call(record_4)])
-    mock_create_review_status_url.assert_has_calls([call(record_2), call(record_3)])
+
+
+@patch("yelp.url_requester.CRON_FULL_REFRESH", True)
+@patch("yelp.url_requester.upsert_new_urls", return_value=[])
+@patch("yelp.url_requester.get_url_ttls")
+@patch("yelp.url_requester.iter_records")
+@patch("yelp.url_requester.get_all_user_ids")
+def test_handle_cron_event_full_refresh(
+    mock_get_all_user_ids, mock_iter_records, mock_get_url_ttls, mock_upsert_new_urls
+):
+    # Given
+    mock_get_all_user_ids.return_value = [USER_ID]
+    mock_iter_records.return_value = USER_RECORDS
+
+    # When
+    handle({"source": "aws.events"})
+
+    # Then
+    mock_get_url_ttls.assert_not_called()
+    mock_upsert_new_urls.assert_called_once_with(USER_ID, derive_urls(USER_ID, USER_RECORDS))
 
 
 @patch("yelp.url_requester._create_review_status_url")
@@ -248,3 +319,40 @@ def test_handle_config_table_event(mock_upsert_new_url):
     mock_upsert_new_url.assert_called_once_with(
         user_id, f"https://www.yelp.com/user_details?userid={user_id}"
     )
+
+
+@patch("yelp.url_requester.upsert_new_url")
+def test_handle_config_table_modify_event(mock_upsert_new_url):
+    # Given
+    event = {
+        "Records": [
+            {
+                "eventName": "MODIFY",
+                "dynamodb": {
+                    "NewImage": {
+                        "UserId": {"S": random_string()},
+                        "CleanerFingerprint": {"S": "12#review-id"},
+                    },
+                },
+                "eventSourceARN": "arn:aws:dynamodb:us-west-1:316936913708:table/ConfigTable/stream/2020-12-26T06:39:42.594",
+            }
+        ]
+    }
+
+    # When
+    handle(event)
+
+    # Then
+    mock_upsert_new_url.assert_not_called()
+
+
+@patch("yelp.url_requester._create_review_status_url")
+def test_handle_yelp_table_incomplete_review_record(mock_create_review_status_url):
+    # Given
+    ddb_record = {"UserId": USER_ID, "SortKey": "Review#test-biz-id", "ReviewStatus": False}
+
+    # When
+    handle_yelp_table_record(ddb_record)
+
+    # Then
+    mock_create_review_status_url.assert_not_called()
@@ -0,0 +1,323 @@
+import threading
+import time
+from unittest.mock import Mock, call, patch
+
+import pytest
+from botocore.exceptions import ClientError
+from yelp import yelp_cleaner
+from yelp.parser.reviews_page_parser import ParsedReviewMetadata
+from yelp.yelp_cleaner import (
+    YelpCleanerError,
+    delete_stale_sort_keys,
+    diff_sorted,
+    fetch_soup,
+    find_stale_sort_keys,
+    get_live_biz_ids,
+    handle,
+    process_user,
+)
+
+
+@patch("yelp.yelp_cleaner.process_user")
+@patch("yelp.yelp_cleaner.get_all_user_ids")
+def test_handle(mock_get_all_user_ids, mock_process_user):
+    # Given
+    mock_get_all_user_ids.return_value = ["user-1", "user-2", "user-3"]
+
+    def process_user(user_id):
+        if user_id == "user-2":
+            raise Exception()
+
+    mock_process_user.side_effect = process_user
+
+    # When
+    with pytest.raises(YelpCleanerError) as error:
+        handle({})
+
+    # Then
+    mock_process_user.assert_has_calls(
+        [call("user-1"), call("user-2"), call("user-3")], any_order=True
+    )
+    assert "Encountered 1 total error(s)" in str(error.value)
+
+
+@patch("yelp.yelp_cleaner.IN_FLIGHT", threading.BoundedSemaphore(2))
+@patch("yelp.yelp_cleaner.fetch")
+def test_fetch_soup_caps_in_flight(mock_fetch):
+    # Given
+    lock = threading.Lock()
+    in_flight, peak = [0], [0]
+
+    def fetch(url):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        return "<html></html>"
+
+    mock_fetch.side_effect = fetch
+
+    # When
+    list(yelp_cleaner.FETCH_EXECUTOR.map(fetch_soup, [f"url-{i}" for i in range(10)]))
+
+    # Then
+    assert mock_fetch.call_count == 10
+    assert peak[0] <= 2
+
+
+@patch("yelp.yelp_cleaner.fetch")
+@patch("yelp.yelp_cleaner.stream_page")
+def test_fetch_soup_fresh(mock_stream_page, mock_fetch):
+    # Given
+    mock_stream_page.return_value = iter(["<p>stored</p>"])
+
+    # When
+    result = fetch_soup("url", {"url"})
+
+    # Then
+    assert result.get_text() == "stored"
+    mock_stream_page.assert_called_once_with("url")
+    mock_fetch.assert_not_called()
+
+
+@patch("yelp.yelp_cleaner.fetch")
+@patch("yelp.yelp_cleaner.stream_page")
+def test_fetch_soup_stale(mock_stream_page, mock_fetch):
+    # Given
+    mock_fetch.return_value = "<p>live</p>"
+
+    # When
+    result = fetch_soup("url", {"other-url"})
+
+    # Then
+    assert result.get_text() == "live"
+    mock_stream_page.assert_not_called()
+
+
+@patch("yelp.yelp_cleaner.fetch")
+@patch("yelp.yelp_cleaner.stream_page")
+def test_fetch_soup_fresh_missing(mock_stream_page, mock_fetch):
+    # Given
+    mock_stream_page.side_effect = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+    mock_fetch.return_value = "<p>live</p>"
+
+    # When
+    result = fetch_soup("url", {"url"})
+
+    # Then
+    assert result.get_text() == "live"
+
+
+@pytest.mark.parametrize(
+    "stored,current,expected",
+    [
+        (["a", "b", "c"], ["b"], ["a", "c"]),
+        (["a", "b"], [], ["a", "b"]),
+        ([], ["a"], []),
+        (["b", "d"], ["a", "b", "c", "d", "e"], []),
+        (["a", "c", "e"], ["b", "d"], ["a", "c", "e"]),
+    ],
+)
+def test_diff_sorted(stored, current, expected):
+    assert list(diff_sorted(iter(stored), current)) == expected
+
+
+def make_table(stored_sort_keys):
+    mock_table = Mock()
+    mock_table.__name__ = "test_table"
+    mock_table.iter_records.return_value = iter(
+        [{"SortKey": sort_key} for sort_key in stored_sort_keys]
+    )
+    mock_table.delete_sort_keys.return_value = []
+    return mock_table
+
+
+def test_find_stale_sort_keys():
+    # Given
+    mock_table = make_table(["Review#a", "Review#b", "Review#c"])
+
+    # When
+    result = find_stale_sort_keys("test-user-id", ["c", "a"], mock_table, "Review#")
+
+    # Then
+    assert result == ["Review#b"]
+    mock_table.iter_records.assert_called_once_with(
+        "test-user-id", "Review#", projection=["SortKey"]
+    )
+
+
+def test_delete_stale_sort_keys():
+    # Given
+    mock_table = make_table([])
+
+    # When
+    result = delete_stale_sort_keys("test-user-id", ["Review#b"], mock_table)
+
+    # Then
+    assert result == ["Review#b"]
+    mock_table.delete_sort_keys.assert_called_once_with("test-user-id", ["Review#b"], 4)
+
+
+@patch("yelp.yelp_cleaner.CLEANER_DRY_RUN", True)
+def test_delete_stale_sort_keys_dry_run():
+    # Given
+    mock_table = make_table([])
+
+    # When
+    result = delete_stale_sort_keys("test-user-id", ["Review#b"], mock_table)
+
+    # Then
+    assert result == ["Review#b"]
+    mock_table.delete_sort_keys.assert_not_called()
+
+
+def test_delete_stale_sort_keys_undeleted():
+    # Given
+    mock_table = make_table([])
+    mock_table.delete_sort_keys.return_value = ["Review#a"]
+
+    # When, Then
+    with pytest.raises(YelpCleanerError):
+        delete_stale_sort_keys("test-user-id", ["Review#a"], mock_table)
+
+
+def make_review(biz_id):
+    return ParsedReviewMetadata(biz_id, "name", "address", f"review-{biz_id}", "1/1/2020")
+
+
+@patch("yelp.yelp_cleaner.set_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.get_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.delete_stale_sort_keys")
+@patch("yelp.yelp_cleaner.fetch_reviews")
+@patch("yelp.yelp_cleaner.fetch_review_count")
+@patch("yelp.yelp_cleaner.url_table.get_recently_fetched_urls")
+def test_process_user_unchanged(
+    _,
+    mock_fetch_review_count,
+    mock_fetch_reviews,
+    mock_delete_stale_sort_keys,
+    mock_get_cleaner_fingerprint,
+    mock_set_cleaner_fingerprint,
+):
+    # Given
+    mock_fetch_review_count.return_value = 12
+    mock_fetch_reviews.return_value = [make_review("a")]
+    mock_get_cleaner_fingerprint.return_value = "12#review-a"
+
+    # When
+    process_user("test-user-id")
+
+    # Then
+    mock_fetch_reviews.assert_called_once()  # Only page 0
+    mock_delete_stale_sort_keys.assert_not_called()
+    mock_set_cleaner_fingerprint.assert_not_called()
+
+
+def reviews_by_page(pages):
+    """fetch_reviews side effect, serving `pages` (page start -> biz ids)."""
+
+    def fetch_reviews(url, fresh_urls=frozenset()):
+        return [make_review(biz_id) for biz_id in pages[int(url.split("rec_pagestart=")[1])]]
+
+    return fetch_reviews
+
+
+@patch("yelp.yelp_cleaner.get_live_biz_ids")
+@patch("yelp.yelp_cleaner.set_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.get_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.delete_stale_sort_keys")
+@patch("yelp.yelp_cleaner.find_stale_sort_keys")
+@patch("yelp.yelp_cleaner.fetch_reviews")
+@patch("yelp.yelp_cleaner.fetch_review_count")
+@patch("yelp.yelp_cleaner.url_table.get_recently_fetched_urls")
+def test_process_user_changed(
+    mock_get_recently_fetched_urls,
+    mock_fetch_review_count,
+    mock_fetch_reviews,
+    mock_find_stale_sort_keys,
+    mock_delete_stale_sort_keys,
+    mock_get_cleaner_fingerprint,
+    mock_set_cleaner_fingerprint,
+    mock_get_live_biz_ids,
+):
+    # Given
+    mock_get_recently_fetched_urls.return_value = set()
+    mock_fetch_review_count.return_value = 12
+    mock_fetch_reviews.side_effect = reviews_by_page({0: ["a"], 10: ["b"]})
+    mock_get_cleaner_fingerprint.return_value = "11#review-c"
+    mock_find_stale_sort_keys.side_effect = lambda user_id, biz_ids, table, prefix: [prefix + "c"]
+    mock_delete_stale_sort_keys.side_effect = lambda user_id, keys, table: keys
+
+    # When
+    process_user("test-user-id")
+
+    # Then
+    assert [c.args[1] for c in mock_find_stale_sort_keys.call_args_list] == [
+        ["a", "b"],
+        ["a", "b"],
+    ]
+    mock_get_live_biz_ids.assert_not_called()  # Every page was already fetched live
+    assert [c.args[1] for c in mock_delete_stale_sort_keys.call_args_list] == [
+        ["SortKey#ReviewStatusPage#c"],
+        ["Review#c"],
+    ]
+    mock_set_cleaner_fingerprint.assert_called_once_with("test-user-id", "12#review-a")
+
+
+@patch("yelp.yelp_cleaner.get_live_biz_ids")
+@patch("yelp.yelp_cleaner.set_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.get_cleaner_fingerprint")
+@patch("yelp.yelp_cleaner.delete_stale_sort_keys")
+@patch("yelp.yelp_cleaner.find_stale_sort_keys")
+@patch("yelp.yelp_cleaner.fetch_reviews")
+@patch("yelp.yelp_cleaner.fetch_review_count")
+@patch("yelp.yelp_cleaner.url_table.get_recently_fetched_urls")
+def test_process_user_confirms_stored_pages_live(
+    mock_get_recently_fetched_urls,
+    mock_fetch_review_count,
+    mock_fetch_reviews,
+    mock_find_stale_sort_keys,
+    mock_delete_stale_sort_keys,
+    mock_get_cleaner_fingerprint,
+    mock_set_cleaner_fingerprint,
+    mock_get_live_biz_ids,
+):
+    # Given
+    mock_get_recently_fetched_urls.return_value = {"stored-url"}
+    mock_fetch_review_count.return_value = 12
+    # "c" moved from page 0 to page 10 between the stored fetches, so it's on neither
+    mock_fetch_reviews.side_effect = reviews_by_page({0: ["a"], 10: ["b"]})
+    mock_get_cleaner_fingerprint.return_value = None
+    mock_find_stale_sort_keys.side_effect = lambda user_id, biz_ids, table, prefix: [
+        prefix + "c",
+        prefix + "d",
+    ]
+    mock_delete_stale_sort_keys.side_effect = lambda user_id, keys, table: keys
+    mock_get_live_biz_ids.return_value = ["a", "b", "c"]
+
+    # When
+    process_user("test-user-id")
+
+    # Then
+    mock_get_live_biz_ids.assert_called_once_with("test-user-id")
+    assert [c.args[1] for c in mock_delete_stale_sort_keys.call_args_list] == [
+        ["SortKey#ReviewStatusPage#d"],
+        ["Review#d"],
+    ]
+
+
+@patch("yelp.yelp_cleaner.fetch_reviews")
+@patch("yelp.yelp_cleaner.fetch_review_count")
+def test_get_live_biz_ids(mock_fetch_review_count, mock_fetch_reviews):
+    # Given
+    mock_fetch_review_count.return_value = 12
+    mock_fetch_reviews.side_effect = reviews_by_page({0: ["a"], 10: ["b"]})
+
+    # When
+    result = get_live_biz_ids("test-user-id")
+
+    # Then
+    assert result == ["a", "b"]
+    mock_fetch_review_count.assert_called_once_with("test-user-id")
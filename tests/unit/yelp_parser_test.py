@@ -6,14 +6,14 @@ from yelp.yelp_parser import UnrecognizedUrlError, YelpParserError, handle, proc
 
 
 @patch("yelp.yelp_parser.UserMetadataParser")
-@patch("yelp.yelp_parser.download_page")
-def test_process_record(mock_download_page, mock_parser_cls):
+@patch("yelp.yelp_parser.open_page")
+def test_process_record(mock_open_page, mock_parser_cls):
     # Given
     url = "https://user_details?userid"
     record = {"s3": {"object": {"key": quote_plus(url)}}}
 
     mock_page = Mock()
-    mock_download_page.return_value = mock_page
+    mock_open_page.return_value = ({"user-id": "test-user-id"}, mock_page)
 
     mock_parser = Mock()
     mock_parser_cls.return_value = mock_parser
@@ -22,10 +22,11 @@ def test_process_record(mock_download_page, mock_parser_cls):
     process_record(record)
 
     # Then
+    mock_parser_cls.assert_called_once_with(user_id="test-user-id")
     mock_parser.process.assert_called_once_with(url, mock_page)
 
 
-@patch("yelp.yelp_parser.download_page")
+@patch("yelp.yelp_parser.open_page")
 def test_process_record_unrecognized_url(_):
     # Given
     url = "foo"
@@ -39,21 +40,41 @@ def test_process_record_unrecognized_url(_):
     assert url in str(error.value)
 
 
+@patch("yelp.yelp_parser.batch_updates")
 @patch("yelp.yelp_parser.process_record")
-def test_handle(mock_process_record):
+def test_handle(mock_process_record, mock_batch_updates):
     # Given
     record_1, record_2, record_3 = Mock(), Mock(), Mock()
     test_event = {"Records": [record_1, record_2, record_3]}
-    mock_process_record.side_effect = [
-        None,
-        Exception(),
-        None,
-    ]
+
+    def process_record(record):
+        if record is record_2:
+            raise Exception()
+
+    mock_process_record.side_effect = process_record
+    mock_batch_updates.return_value.__enter__.return_value.failures = []
+
+    # When
+    with pytest.raises(YelpParserError) as error:
+        handle(test_event)
+
+    # Then
+    mock_process_record.assert_has_calls(
+        [call(record_1), call(record_2), call(record_3)], any_order=True
+    )
+    assert "Encountered 1 total error(s)" in str(error.value)
+
+
+@patch("yelp.yelp_parser.batch_updates")
+@patch("yelp.yelp_parser.process_record")
+def test_handle_unwritten_results(_, mock_batch_updates):
+    # Given
+    test_event = {"Records": [Mock()]}
+    mock_batch_updates.return_value.__enter__.return_value.failures = [Mock()]
 
     # When
     with pytest.raises(YelpParserError) as error:
         handle(test_event)
 
     # Then
-    mock_process_record.assert_has_calls([call(record_1), call(record_2), call(record_3)])
     assert "Encountered 1 total error(s)" in str(error.value)
@@ -3,7 +3,9 @@ import os
 import sys
 import traceback
 
-import requests
+from yelp.http_session import create_session
+
+SESSION = create_session()
 
 
 def usage():
@@ -25,7 +27,7 @@ def get_test_path(arg):
 
 
 def fetch(url):
-    resp = requests.get(url)
+    resp = SESSION.get(url)
     if resp.status_code != 200:
         print(f"Error while updating URL: {url}.")
         traceback.print_exc()